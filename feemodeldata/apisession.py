@@ -0,0 +1,190 @@
+'''Pooled keep-alive client for the feemodel API.'''
+from __future__ import division
+
+import os
+import json
+import pickle
+import threading
+from time import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from feemodel.config import config, datadir
+
+from feemodeldata.util import atomic_write
+
+API_URL = os.environ.get("FEEMODEL_API_URL")
+if API_URL is None:
+    # The same as feemodel.apiclient.APIClient.
+    API_URL = "http://localhost:{}/feemodel/".format(
+        config.getint("app", "port"))
+# Max number of pooled connections to the API host.
+POOL_MAXSIZE = 8
+# (connect, read) timeouts in seconds for each socket operation.
+REQUEST_TIMEOUT = (5, 10)
+# Max seconds to receive a whole response in. A request can take up to
+# this plus the read timeout, since the socket reads are not interrupted.
+REQUEST_TOTAL_TIMEOUT = 20
+# Size in bytes of the chunks in which responses are read.
+RESPONSE_CHUNK_SIZE = 65536
+# Responses which only change when a new block arrives are cached, in
+# memory and in APICACHEDIR, keyed by the best block height. They are
+# refetched anyway after CACHE_MAXAGE seconds.
+APICACHEDIR = os.path.join(datadir, 'apicache')
+CACHE_MAXAGE = 600
+# Seconds after a new best height is first seen during which responses
+# aren't cached, since the feemodel app may not have processed the block
+# yet.
+CACHE_SETTLE_TIME = 120
+
+
+class APISession(object):
+    '''Client for the feemodel API which reuses its HTTP connections.
+
+    Has the same interface as feemodel.apiclient.APIClient, but requests
+    go through a single requests.Session, so connections are kept alive
+    and pooled across calls and threads instead of being opened anew for
+    each request.
+
+    The pools and prediction stats are cached by best block height (see
+    _get_cached); the cached objects are shared, so don't modify them.
+
+    There is no batched fee estimate: the API has no route for it, and
+    inverting the transient wait curve locally can't be checked against
+    the server's estimatefee. Each estimate is an estimatefee request,
+    which is cheap over a kept-alive connection.
+    '''
+
+    def __init__(self, url=API_URL, cachedir=APICACHEDIR):
+        self.url = url if url.endswith('/') else url + '/'
+        self.cachedir = cachedir
+        # resource name -> (height, fetchtime, payload)
+        self.cache = {}
+        # (best height, time it was first seen)
+        self.heightseen = None
+        self.proxy = None
+        self.proxylock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_transient(self):
+        return self._get_resource("transient")
+
+    def get_mempool(self):
+        return self._get_resource("mempool")
+
+    def get_txrate(self):
+        return self._get_resource("txrate")
+
+    def get_pools(self):
+        return self._get_cached("pools", lambda: self._get_resource("pools"))
+
+    def get_prediction(self):
+        return self._get_cached(
+            "prediction", lambda: self._get_resource("prediction"))
+
+    def get_poolsobj(self):
+        # The pools estimator object is decoded by feemodel itself.
+        from feemodel.apiclient import client
+        return self._get_cached("poolsobj", client.get_poolsobj)
+
+    def estimatefee(self, conftime):
+        return self._get_resource("estimatefee/{}".format(conftime))
+
+    def close(self):
+        self.session.close()
+
+    def get_bestheight(self):
+        '''Get the best block height from bitcoind.'''
+        with self.proxylock:
+            if self.proxy is None:
+                from bitcoin.rpc import Proxy
+                self.proxy = Proxy()
+            return self.proxy.getblockcount()
+
+    def _get_resource(self, path):
+        '''Get the decoded JSON resource.
+
+        Raises requests.Timeout if the response is not received within
+        REQUEST_TOTAL_TIMEOUT seconds (give or take a read timeout), so
+        that a slow response can't hold the calling thread for long.
+        '''
+        deadline = time() + REQUEST_TOTAL_TIMEOUT
+        r = self.session.get(self.url + path, timeout=REQUEST_TIMEOUT,
+                             stream=True)
+        try:
+            r.raise_for_status()
+            chunks = []
+            for chunk in r.iter_content(RESPONSE_CHUNK_SIZE):
+                chunks.append(chunk)
+                if time() > deadline:
+                    raise requests.Timeout(
+                        "{} not received within {}s.".format(
+                            path, REQUEST_TOTAL_TIMEOUT))
+        finally:
+            r.close()
+        return json.loads(b''.join(chunks).decode('utf-8'))
+
+    def _get_cached(self, name, fetch):
+        '''Get the named resource, using the cache if it is still valid.
+
+        The cache entry is valid if it was fetched at the current best
+        block height, less than CACHE_MAXAGE seconds ago. Validating it
+        only takes a getblockcount call to bitcoind. The in-memory cache is
+        backed by a file in cachedir, so that it is shared between
+        processes. If the height can't be obtained, the resource is
+        fetched without caching.
+
+        bitcoind's height runs ahead of the feemodel app, which processes
+        a block some time after bitcoind has it, so a response is not
+        cached if it was fetched within CACHE_SETTLE_TIME seconds of the
+        height being first seen.
+        '''
+        try:
+            height = self.get_bestheight()
+        except Exception:
+            with self.proxylock:
+                self.proxy = None
+            return fetch()
+        heightseen = self.heightseen
+        if heightseen is None or heightseen[0] != height:
+            heightseen = self.heightseen = (height, time())
+
+        def isvalid(entry):
+            return (entry is not None and entry[0] == height and
+                    time() - entry[1] < CACHE_MAXAGE)
+
+        entry = self.cache.get(name)
+        if not isvalid(entry):
+            entry = self._read_cachefile(name)
+        if not isvalid(entry):
+            if time() - heightseen[1] < CACHE_SETTLE_TIME:
+                return fetch()
+            entry = (height, time(), fetch())
+            self._write_cachefile(name, entry)
+        self.cache[name] = entry
+        return entry[2]
+
+    def _read_cachefile(self, name):
+        try:
+            with open(os.path.join(self.cachedir, name), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def _write_cachefile(self, name, entry):
+        try:
+            if not os.path.exists(self.cachedir):
+                os.makedirs(self.cachedir)
+            filename = os.path.join(self.cachedir, name)
+            with atomic_write(filename, "wb") as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # The in-memory cache still works.
+            pass
+
+
+session = APISession()
@@ -0,0 +1,169 @@
+'''On-disk snapshots of the feemodel API state, shared by the publishers.
+
+A snapshot holds every resource the publishers use, fetched together, so
+that jobs run within the same interval read the same data instead of
+each fetching it. Snapshots are zlib-compressed pickles in SNAPSHOTDIR,
+named by their fetch time and block height, and written atomically.
+'''
+from __future__ import division
+
+import os
+import zlib
+import pickle
+import logging
+import threading
+from time import time
+from multiprocessing.pool import ThreadPool
+
+from feemodel.config import datadir
+
+from feemodeldata.apisession import session
+from feemodeldata.util import atomic_write
+
+SNAPSHOTDIR = os.path.join(datadir, 'apisnapshots')
+# Seconds between snapshots when run in a loop.
+SNAPSHOT_INTERVAL = 300
+# Age in seconds beyond which a snapshot is not used.
+SNAPSHOT_MAXAGE = 2*SNAPSHOT_INTERVAL
+# Number of snapshot files to keep.
+SNAPSHOT_KEEP = 12
+# Seconds for which SnapshotClient keeps a loaded snapshot before
+# checking for a newer one.
+SNAPSHOT_RELOAD = 60
+# The APISession methods whose results are snapshotted.
+RESOURCES = ['transient', 'mempool', 'txrate', 'pools', 'poolsobj',
+             'prediction']
+
+logger = logging.getLogger(__name__)
+
+
+def take_snapshot(apiclient=session, snapshotdir=SNAPSHOTDIR):
+    '''Fetch all the RESOURCES concurrently, and store them as a snapshot.
+
+    Returns the snapshot filename.
+    '''
+    try:
+        height = apiclient.get_bestheight()
+    except Exception:
+        logger.warning("Unable to get the best height for the snapshot.")
+        height = None
+    snaptime = int(time())
+    pool = ThreadPool(len(RESOURCES))
+    try:
+        results = [
+            (name, pool.apply_async(getattr(apiclient, "get_" + name)))
+            for name in RESOURCES]
+        snapshot = {
+            'time': snaptime,
+            'height': height,
+            'resources': dict((name, result.get())
+                              for name, result in results)
+        }
+    finally:
+        pool.close()
+        pool.join()
+    if not os.path.exists(snapshotdir):
+        os.makedirs(snapshotdir)
+    filename = os.path.join(snapshotdir, "{}_{}.pickle.z".format(
+        snaptime, height if height is not None else 'x'))
+    with atomic_write(filename, "wb") as f:
+        f.write(zlib.compress(
+            pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)))
+    prune_snapshots(snapshotdir)
+    return filename
+
+
+def load_latest_snapshot(snapshotdir=SNAPSHOTDIR, maxage=SNAPSHOT_MAXAGE):
+    '''Load the latest snapshot, or return None if there is none.
+
+    Snapshots older than maxage seconds are ignored.
+    '''
+    for snaptime, filename in reversed(list_snapshots(snapshotdir)):
+        if time() - snaptime > maxage:
+            return None
+        try:
+            with open(filename, "rb") as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except Exception:
+            logger.exception("Unable to load snapshot {}.".format(filename))
+    return None
+
+
+def list_snapshots(snapshotdir=SNAPSHOTDIR):
+    '''Get the sorted list of (snapshot time, filename) in snapshotdir.'''
+    try:
+        basenames = os.listdir(snapshotdir)
+    except OSError:
+        return []
+    snapshots = []
+    for basename in basenames:
+        if not basename.endswith('.pickle.z'):
+            continue
+        try:
+            snaptime = int(basename.split('_')[0])
+        except ValueError:
+            continue
+        snapshots.append((snaptime, os.path.join(snapshotdir, basename)))
+    return sorted(snapshots)
+
+
+def prune_snapshots(snapshotdir=SNAPSHOTDIR, keep=SNAPSHOT_KEEP):
+    for _dum, filename in list_snapshots(snapshotdir)[:-keep]:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+class SnapshotClient(object):
+    '''Client which reads the API resources from the latest snapshot.
+
+    Has the getters of APISession for the snapshotted RESOURCES. The
+    snapshot is loaded on first use and kept for SNAPSHOT_RELOAD seconds,
+    so that the calls of a single job see the same snapshot. If there is
+    no recent snapshot, the getters fall back to the live API.
+    '''
+
+    def __init__(self, apiclient=session, snapshotdir=SNAPSHOTDIR,
+                 maxage=SNAPSHOT_MAXAGE):
+        self.apiclient = apiclient
+        self.snapshotdir = snapshotdir
+        self.maxage = maxage
+        self.snapshot = None
+        self.loadtime = None
+        self.lock = threading.Lock()
+
+    def get_transient(self):
+        return self._get("transient")
+
+    def get_mempool(self):
+        return self._get("mempool")
+
+    def get_txrate(self):
+        return self._get("txrate")
+
+    def get_pools(self):
+        return self._get("pools")
+
+    def get_poolsobj(self):
+        return self._get("poolsobj")
+
+    def get_prediction(self):
+        return self._get("prediction")
+
+    def _get(self, name):
+        with self.lock:
+            if (self.loadtime is None or
+                    time() - self.loadtime > SNAPSHOT_RELOAD):
+                self.snapshot = load_latest_snapshot(
+                    self.snapshotdir, self.maxage)
+                self.loadtime = time()
+                if self.snapshot is None:
+                    logger.info("No recent snapshot, using the live API.")
+            snapshot = self.snapshot
+        if snapshot is None:
+            return getattr(self.apiclient, "get_" + name)()
+        return snapshot['resources'][name]
+
+
+client = SnapshotClient()
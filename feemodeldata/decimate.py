@@ -0,0 +1,87 @@
+'''Shape-preserving decimation of time series for plotting.
+
+Both methods return the sorted indices of the points to keep, so that
+the same selection can be applied to the x and y values. Unknown (NaN)
+values are never picked over known ones, but a bucket with no known
+values keeps one unknown point, so that gaps still show in the plot.
+'''
+from __future__ import division
+
+import numpy as np
+
+
+def lttb(x, y, numpoints):
+    '''Largest-triangle-three-buckets decimation to numpoints points.
+
+    The first and last points are always kept. The points in between are
+    split into numpoints-2 buckets, and from each bucket the point is kept
+    which forms the largest triangle with the previously kept point and
+    the average of the next bucket.
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if numpoints >= n or numpoints < 3:
+        return np.arange(n)
+    edges = (np.arange(numpoints - 1) * (n - 2) / (numpoints - 2)).astype(
+        int) + 1
+    edges[-1] = n - 1
+    known = ~np.isnan(y)
+    keep = [0]
+    # The previously kept known point.
+    ax, ay = x[0], y[0]
+    for i in range(numpoints - 2):
+        start, end = edges[i], edges[i+1]
+        # Average of the next bucket (the last point for the last bucket).
+        nextend = edges[i+2] if i + 2 < len(edges) else n
+        nextknown = known[end:nextend]
+        if nextknown.any():
+            cx = x[end:nextend][nextknown].mean()
+            cy = y[end:nextend][nextknown].mean()
+        else:
+            cx, cy = x[end:nextend].mean(), ay
+        bucketknown = known[start:end]
+        if not bucketknown.any():
+            keep.append(start)
+            continue
+        if np.isnan(ay):
+            # No known point kept yet; compare against the next bucket.
+            ax, ay = cx, cy
+        bx, by = x[start:end], y[start:end]
+        areas = np.abs((ax - cx)*(by - ay) - (ax - bx)*(cy - ay))
+        areas[~bucketknown] = -1
+        idx = start + int(np.argmax(areas))
+        keep.append(idx)
+        ax, ay = x[idx], y[idx]
+    keep.append(n - 1)
+    return np.array(keep)
+
+
+def minmax(x, y, numpoints):
+    '''Min/max envelope decimation to at most numpoints points.
+
+    The points are split into numpoints//2 buckets, and the min and max
+    points of each bucket are kept, so that spikes are never lost.
+    '''
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    numbuckets = numpoints // 2
+    if numpoints >= n or numbuckets < 1:
+        return np.arange(n)
+    edges = (np.arange(numbuckets + 1) * n / numbuckets).astype(int)
+    keep = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = y[start:end]
+        known = ~np.isnan(bucket)
+        if not known.any():
+            keep.append(start)
+            continue
+        keep.append(start + int(np.argmin(np.where(known, bucket, np.inf))))
+        keep.append(start + int(np.argmax(np.where(known, bucket, -np.inf))))
+    return np.unique(keep)
+
+
+DECIMATORS = {
+    'lttb': lttb,
+    'minmax': minmax
+}
@@ -0,0 +1,180 @@
+'''In-process metrics registry, served over HTTP.
+
+Metrics are rendered in the Prometheus text exposition format, so that
+they can be scraped and dashboarded.
+'''
+from __future__ import division
+
+import os
+import threading
+import logging
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+METRICS_PORT = int(os.environ.get("FEEMODEL_METRICS_PORT", 8352))
+# Upper bounds in seconds of the default latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger(__name__)
+
+
+class Counter(object):
+    '''Monotonically increasing count.'''
+
+    metrictype = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [('', {}, self.value)]
+
+
+class Gauge(object):
+    '''Value which can go up and down.'''
+
+    metrictype = 'gauge'
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        if self.value is None:
+            return []
+        return [('', {}, self.value)]
+
+
+class Histogram(object):
+    '''Counts of observations in cumulative buckets.'''
+
+    metrictype = 'histogram'
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = sorted(buckets)
+        self.counts = [0]*len(self.buckets)
+        self.count = 0
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            samples = [('_bucket', {'le': repr(float(bound))}, count)
+                       for bound, count in zip(self.buckets, self.counts)]
+            samples.append(('_bucket', {'le': '+Inf'}, self.count))
+            samples.append(('_count', {}, self.count))
+            samples.append(('_sum', {}, self.sum))
+        return samples
+
+
+class MetricsRegistry(object):
+    '''Registry of named metrics.
+
+    Each metric is identified by its name and label values, and is created
+    on first use, e.g. registry.counter("failures_total", "Failures.",
+    datasource="fee12").inc().
+    '''
+
+    def __init__(self):
+        # name -> (metric class, help, {labels: metric})
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name, helpstr, **labels):
+        return self._get(Counter, name, helpstr, labels)
+
+    def gauge(self, name, helpstr, **labels):
+        return self._get(Gauge, name, helpstr, labels)
+
+    def histogram(self, name, helpstr, **labels):
+        return self._get(Histogram, name, helpstr, labels)
+
+    def render(self):
+        '''Get the metrics in the Prometheus text format.'''
+        lines = []
+        with self.lock:
+            metrics = sorted(
+                (name, cls, helpstr, sorted(children.items()))
+                for name, (cls, helpstr, children) in self.metrics.items())
+        for name, cls, helpstr, children in metrics:
+            lines.append("# HELP {} {}".format(name, helpstr))
+            lines.append("# TYPE {} {}".format(name, cls.metrictype))
+            for labels, metric in children:
+                for suffix, extralabels, value in metric.samples():
+                    lines.append("{}{}{} {}".format(
+                        name, suffix,
+                        format_labels(list(labels) +
+                                      sorted(extralabels.items())),
+                        value))
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, cls, name, helpstr, labels):
+        labels = tuple(sorted(labels.items()))
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = (cls, helpstr, {})
+            metriccls, _dum, children = self.metrics[name]
+            if metriccls is not cls:
+                raise ValueError("{} is a {}.".format(name, metriccls))
+            if labels not in children:
+                children[labels] = cls()
+            return children[labels]
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, value)
+                          for key, value in labels) + '}'
+
+
+class MetricsServer(threading.Thread):
+    '''Serves a registry's metrics at http://127.0.0.1:<port>/metrics.'''
+
+    def __init__(self, registry, port=METRICS_PORT):
+        super(MetricsServer, self).__init__()
+        self.daemon = True
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', port), Handler)
+
+    def run(self):
+        logger.info("Serving metrics on port {}.".
+                    format(self.server.server_address[1]))
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
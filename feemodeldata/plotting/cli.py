@@ -9,15 +9,17 @@ def cli():
 
 @cli.command()
 @click.option("--basedir", "-d", type=click.STRING, default=BASEDIR)
+@click.option("--incremental", "-i", is_flag=True,
+              help="Only send the points since the last plot.")
 @click.argument("resnumber", type=click.INT, required=True)
-def rrd(resnumber, basedir):
+def rrd(resnumber, basedir, incremental):
     if resnumber not in [0, 1, 2, 3]:
         click.echo("resnumber needs to be in [0, 1, 2, 3].")
         return
     from feemodeldata.plotting import logger
     from feemodeldata.plotting.plotrrd import plot_latest
     try:
-        plot_latest(resnumber, basedir=basedir)
+        plot_latest(resnumber, basedir=basedir, incremental=incremental)
     except Exception:
         logger.exception("Exception in plotting rrd.")
 
@@ -39,6 +41,46 @@ def rrdtable(resnumber, credentialsfile):
         logger.info("rrd table pushed.")
 
 
+@cli.command()
+@click.option("--basedir", "-d", type=click.STRING, default=BASEDIR)
+@click.option("--credentialsfile", "-c", type=click.STRING, default=None,
+              help="Also push to the spreadsheet.")
+@click.option("--outdir", "-o", type=click.STRING, default=None,
+              help="Also write the data to a local file in this dir.")
+@click.option("--format", "-f", "fmt", type=click.Choice(['json', 'csv']),
+              default="json")
+@click.option("--incremental", "-i", is_flag=True,
+              help="Only send the points since the last plot.")
+@click.argument("resnumber", type=click.STRING, required=True)
+def publish(resnumber, basedir, credentialsfile, outdir, fmt, incremental):
+    """Fetch once and publish to plotly, sheets and files.
+
+    resnumber is in [0, 1, 2, 3], or 'all'.
+    """
+    if resnumber == 'all':
+        resnumbers = [0, 1, 2, 3]
+    elif resnumber in ['0', '1', '2', '3']:
+        resnumbers = [int(resnumber)]
+    else:
+        click.echo("resnumber needs to be in [0, 1, 2, 3] or 'all'.")
+        return
+    from feemodeldata.plotting import logger
+    from feemodeldata.plotting.publish import publish as _publish
+    try:
+        results = _publish(resnumbers, basedir=basedir,
+                           credentialsfile=credentialsfile, outdir=outdir,
+                           fmt=fmt, incremental=incremental)
+    except Exception:
+        logger.exception("Exception in publishing rrd.")
+        return
+    for resnumber, sink, elapsed, error in results:
+        status = "failed ({})".format(repr(error)) if error else "ok"
+        message = "Published rrd {} to {} in {:.2f}s: {}".format(
+            resnumber, sink, elapsed, status)
+        logger.info(message)
+        click.echo(message)
+
+
 @cli.command()
 @click.option("--cf", "-c",
               type=click.Choice(['AVERAGE', 'MIN', 'MAX']),
@@ -47,9 +89,14 @@ def rrdtable(resnumber, credentialsfile):
 @click.option("--filename", "-f",
               type=click.STRING,
               default="testing/customrrd")
+@click.option("--points", "-p", type=click.INT, default=None,
+              help="Decimate each trace to about this many points.")
+@click.option("--decimation", type=click.Choice(['lttb', 'minmax']),
+              default="lttb")
 @click.argument("starttime", type=click.STRING, required=True)
 @click.argument("endtime", type=click.STRING, required=True)
-def rrdcustom(starttime, endtime, interval, cf, filename):
+def rrdcustom(starttime, endtime, interval, cf, filename, points,
+              decimation):
     """datetime format is %Y/%m/%d %H:%M"""
     from datetime import datetime
     from feemodeldata.util import utc_to_timestamp
@@ -61,7 +108,69 @@ def rrdcustom(starttime, endtime, interval, cf, filename):
     start_timestamp = utc_to_timestamp(start_dt)
     end_timestamp = utc_to_timestamp(end_dt)
     plot_custom(start_timestamp, end_timestamp, interval,
-                cf=cf, filename=filename)
+                cf=cf, filename=filename, numpoints=points,
+                decimation=decimation)
+
+
+@cli.command()
+@click.option("--format", "-f", "fmt",
+              type=click.Choice(['csv', 'npz', 'parquet']), default="csv")
+@click.option("--interval", "-i", type=click.INT, default=10800)
+@click.option("--cf", "-c", "cfs", multiple=True,
+              type=click.Choice(['AVERAGE', 'MIN', 'MAX']),
+              help="Consolidation function to export; defaults to all.")
+@click.option("--output", "-o", type=click.STRING, default="-",
+              help="Output file, or - for stdout.")
+@click.argument("starttime", type=click.STRING, required=True)
+@click.argument("endtime", type=click.STRING, required=True)
+def export(starttime, endtime, fmt, interval, cfs, output):
+    """Export a time range; datetime format is %Y/%m/%d %H:%M"""
+    from datetime import datetime
+    from feemodeldata.util import utc_to_timestamp
+    from feemodeldata.plotting.export import CFS, export as _export
+
+    date_fmt = "%Y/%m/%d %H:%M"
+    start_timestamp = utc_to_timestamp(datetime.strptime(starttime, date_fmt))
+    end_timestamp = utc_to_timestamp(datetime.strptime(endtime, date_fmt))
+    try:
+        _export(start_timestamp, end_timestamp, interval, output, fmt=fmt,
+                cfs=list(cfs) or CFS)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+
+
+@cli.command()
+@click.option("--port", "-p", type=click.INT, default=None)
+def serve(port):
+    """Serve the rrd and profile data as JSON over HTTP."""
+    from feemodeldata.plotting.dataservice import (DataService,
+                                                   DATASERVICE_PORT)
+    service = DataService(port=port or DATASERVICE_PORT)
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        service.server.server_close()
+
+
+@cli.command()
+@click.option("--loop", "-l", is_flag=True,
+              help="Take a snapshot every SNAPSHOT_INTERVAL seconds.")
+def snapshot(loop):
+    """Snapshot the API state for the publishers."""
+    from time import time, sleep
+    from feemodeldata.plotting import logger
+    from feemodeldata.apisnapshot import take_snapshot, SNAPSHOT_INTERVAL
+    while True:
+        starttime = time()
+        try:
+            filename = take_snapshot()
+        except Exception:
+            logger.exception("Exception in taking API snapshot.")
+        else:
+            logger.info("API snapshot written to {}.".format(filename))
+        if not loop:
+            return
+        sleep(max(SNAPSHOT_INTERVAL - (time() - starttime), 0))
 
 
 @cli.command()
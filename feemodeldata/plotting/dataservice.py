@@ -0,0 +1,211 @@
+'''Local HTTP service which serves the RRD and profile data as JSON.
+
+Endpoints:
+
+    /latest/<resnumber>
+        The latest window of a RRDGRAPH_SCHEMA resolution level.
+    /range?start=<t>&end=<t>&interval=<s>[&cf=<cf>]
+        The datapoints in a time range, as from get_datapoints.
+    /profile
+        The wait, mempool, tx rate and capacity curves of the profile plot.
+
+Responses are cached in memory until the next collection tick, so that
+any number of readers can be served without touching the RRD or the API.
+Responses carry an ETag, and are gzipped if the client accepts it.
+'''
+from __future__ import division
+
+import os
+import gzip
+import json
+import hashlib
+import threading
+from io import BytesIO
+from time import time
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+from feemodeldata.rrdcollect import STEP, DSNAMES
+from feemodeldata.plotting import logger
+from feemodeldata.plotting.plotrrd import (RRDGRAPH_SCHEMA, get_datapoints,
+                                           get_latest_datapoints, tolist)
+from feemodeldata.plotting.export import check_interval
+
+DATASERVICE_PORT = int(os.environ.get("FEEMODEL_DATASERVICE_PORT", 8353))
+# Max number of points in a /range response.
+MAX_RANGE_POINTS = 100000
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ResponseCache(object):
+    '''Cache of encoded responses, which expire at the next STEP tick.
+
+    Concurrent requests for the same uncached path wait for the one
+    request which computes it, instead of each computing it.
+    '''
+
+    def __init__(self):
+        # path -> (expiry, etag, body, gzipped body)
+        self.entries = {}
+        # path -> lock held while computing the path's response
+        self.pathlocks = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, compute):
+        '''Get the response entry of path.
+
+        compute is called to get the response object if there is no
+        unexpired entry.
+        '''
+        entry = self.entries.get(path)
+        if entry is not None and time() < entry[0]:
+            return entry
+        with self.lock:
+            pathlock = self.pathlocks.setdefault(path, threading.Lock())
+        with pathlock:
+            entry = self.entries.get(path)
+            if entry is not None and time() < entry[0]:
+                return entry
+            body = json.dumps(compute()).encode('utf-8')
+            entry = (
+                (int(time()) // STEP + 1) * STEP,
+                '"{}"'.format(hashlib.sha1(body).hexdigest()),
+                body,
+                gzip_bytes(body))
+            with self.lock:
+                # Evict the expired entries, so that arbitrary /range
+                # queries don't accumulate.
+                now = time()
+                for oldpath, oldentry in list(self.entries.items()):
+                    if oldentry[0] <= now:
+                        del self.entries[oldpath]
+                        self.pathlocks.pop(oldpath, None)
+                self.entries[path] = entry
+            return entry
+
+
+def gzip_bytes(data):
+    buf = BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def datapoints_to_dict(times, tracesdata):
+    data = dict(zip(DSNAMES, tolist(tracesdata)))
+    data['times'] = tolist(times)
+    return data
+
+
+def get_latest(resnumber):
+    if resnumber not in range(len(RRDGRAPH_SCHEMA)):
+        raise ValueError("resnumber needs to be in {}.".format(
+            list(range(len(RRDGRAPH_SCHEMA)))))
+    return datapoints_to_dict(*get_latest_datapoints(resnumber))
+
+
+def get_range(query):
+    try:
+        starttime = int(query['start'][0])
+        endtime = int(query['end'][0])
+        interval = int(query['interval'][0])
+    except (KeyError, ValueError):
+        raise ValueError("start, end and interval are required integers.")
+    cf = query.get('cf', ['AVERAGE'])[0]
+    if cf not in ['AVERAGE', 'MIN', 'MAX']:
+        raise ValueError("Unknown cf {}.".format(cf))
+    if interval <= 0 or endtime <= starttime:
+        raise ValueError("Empty range.")
+    if (endtime - starttime) // interval > MAX_RANGE_POINTS:
+        raise ValueError("More than {} points requested.".format(
+            MAX_RANGE_POINTS))
+    # The serving archive must downsample evenly to interval.
+    check_interval([starttime], interval, [cf])
+    return datapoints_to_dict(
+        *get_datapoints(starttime, endtime, interval, cf=cf))
+
+
+def get_profile():
+    from feemodeldata.plotting.plotprofile import (
+        get_waitsgraph, get_mempoolgraph, get_txgraph, get_poolsgraph)
+    return dict(
+        (name, {'feerates': list(trace['x']), 'values': list(trace['y'])})
+        for name, trace in [
+            ('expectedwaits', get_waitsgraph()),
+            ('mempoolsize', get_mempoolgraph()),
+            ('txbyterate', get_txgraph()),
+            ('capacity', get_poolsgraph())])
+
+
+class DataService(threading.Thread):
+    '''Serves the data at http://127.0.0.1:<port>/.'''
+
+    def __init__(self, port=DATASERVICE_PORT):
+        super(DataService, self).__init__()
+        self.daemon = True
+        cache = ResponseCache()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                try:
+                    if parts[0] == 'latest' and len(parts) == 2:
+                        resnumber = int(parts[1])
+                        compute = lambda: get_latest(resnumber)
+                    elif parts == ['range']:
+                        query = parse_qs(url.query)
+                        compute = lambda: get_range(query)
+                    elif parts == ['profile']:
+                        compute = get_profile
+                    else:
+                        self.send_error(404)
+                        return
+                    key = url.path + '?' + url.query
+                    _dum, etag, body, gzipbody = cache.get(key, compute)
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                except Exception:
+                    logger.exception("Exception in serving {}.".
+                                     format(self.path))
+                    self.send_error(500)
+                    return
+                if etag in self.headers.get('If-None-Match', ''):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('ETag', etag)
+                self.send_header('Vary', 'Accept-Encoding')
+                if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzipbody
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    def run(self):
+        logger.info("Serving data on port {}.".
+                    format(self.server.server_address[1]))
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
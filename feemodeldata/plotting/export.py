@@ -0,0 +1,205 @@
+'''Export RRD time ranges to CSV, NPZ or Parquet.
+
+The range is read and written window by window, so memory use is bounded
+by the window size, not the length of the range.
+'''
+from __future__ import division
+
+import os
+import csv
+import sys
+import shutil
+import zipfile
+import tempfile
+
+import numpy as np
+
+from feemodeldata.rrdcollect import DSNAMES
+from feemodeldata.plotting.plotrrd import get_backend, get_datapoints_bands
+
+CFS = ['AVERAGE', 'MIN', 'MAX']
+# Number of rows read and written at a time.
+EXPORT_WINDOW_ROWS = 10080
+# The datasources of get_datapoints (all but the pdistance).
+EXPORT_DSNAMES = DSNAMES[:-1]
+
+
+def export(starttime, endtime, interval, outfile, fmt='csv', cfs=CFS,
+           windowrows=EXPORT_WINDOW_ROWS):
+    '''Export the time range at the specified interval to outfile.
+
+    outfile is a filename, or '-' for stdout. fmt is 'csv', 'npz' or
+    'parquet' (which requires pyarrow). Each row is a point time, and
+    there is a column for each consolidation function in cfs and each
+    datasource, named <dsname>_<cf>, with unknown values empty/NaN.
+    '''
+    names = ["{}_{}".format(name, cf.lower())
+             for cf in cfs for name in EXPORT_DSNAMES]
+    times = np.arange(starttime - starttime % interval + interval,
+                      endtime + interval, interval)
+    times = times[times - interval < endtime]
+    check_interval(times[::windowrows] - interval, interval, cfs)
+    exporter = EXPORTERS[fmt](outfile, names, len(times))
+    try:
+        for idx in range(0, len(times), windowrows):
+            windowtimes = times[idx:idx+windowrows]
+            exporter.write(windowtimes,
+                           get_window(windowtimes, interval, cfs))
+    except Exception:
+        exporter.close(success=False)
+        raise
+    exporter.close()
+
+
+def check_interval(windowstarts, interval, cfs):
+    '''Check that the windows can be fetched at interval.
+
+    Each window is served by the finest archive of each cf which holds
+    its start (or the coarsest one, if none does), and interval must be a
+    multiple of that archive's interval. Raises ValueError otherwise, so
+    that nothing is written.
+    '''
+    for cf in cfs:
+        archives = get_backend().get_archives(cf)
+        for windowstart in windowstarts:
+            archiveinterval = archives[-1][0]
+            for _archiveinterval, firsttime in archives:
+                if firsttime <= windowstart:
+                    archiveinterval = _archiveinterval
+                    break
+            if interval % archiveinterval:
+                raise ValueError(
+                    "interval must be a multiple of {} for {} data from "
+                    "{}.".format(archiveinterval, cf, windowstart))
+
+
+def get_window(times, interval, cfs):
+    '''Get the (len(cfs)*numdatasources, len(times)) data array.
+
+    The cfs are fetched together by get_datapoints_bands, which
+    consolidates each cf with its own function when downsampling. The
+    points are placed by their times, so that points missing from the
+    fetch are left NaN.
+    '''
+    numds = len(EXPORT_DSNAMES)
+    data = np.full((len(cfs)*numds, len(times)), np.nan)
+    fetchtimes, tracesdata = get_datapoints_bands(
+        times[0] - interval, times[-1], interval, cfs=cfs)
+    pos = np.searchsorted(times, fetchtimes)
+    valid = pos < len(times)
+    valid[valid] = times[pos[valid]] == fetchtimes[valid]
+    data[:, pos[valid]] = tracesdata[..., valid].reshape(len(cfs)*numds, -1)
+    return data
+
+
+def open_output(outfile, mode):
+    if outfile == '-':
+        if 'b' in mode:
+            return getattr(sys.stdout, 'buffer', sys.stdout)
+        return sys.stdout
+    return open(outfile, mode)
+
+
+class CSVExporter(object):
+
+    def __init__(self, outfile, names, numrows):
+        self.f = open_output(outfile, 'w')
+        self.outfile = outfile
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(['time'] + names)
+
+    def write(self, times, data):
+        for t, row in zip(times.tolist(), data.T.tolist()):
+            self.writer.writerow(
+                [t] + ['' if d != d else d for d in row])
+
+    def close(self, success=True):
+        if self.outfile == '-':
+            self.f.flush()
+        else:
+            self.f.close()
+
+
+class NPZExporter(object):
+    '''Writes each column to a memory-mapped .npy file in a temp dir.
+
+    On close, the .npy files are zipped into the .npz outfile.
+    '''
+
+    def __init__(self, outfile, names, numrows):
+        self.outfile = outfile
+        self.tmpdir = tempfile.mkdtemp(prefix='feemodel-export')
+        self.columns = []
+        for name in ['times'] + names:
+            filename = os.path.join(self.tmpdir, name + '.npy')
+            dtype = int if name == 'times' else float
+            self.columns.append((filename, np.lib.format.open_memmap(
+                filename, mode='w+', dtype=dtype, shape=(numrows,))))
+        self.row = 0
+
+    def write(self, times, data):
+        endrow = self.row + len(times)
+        self.columns[0][1][self.row:endrow] = times
+        for (_dum, column), values in zip(self.columns[1:], data):
+            column[self.row:endrow] = values
+        self.row = endrow
+
+    def close(self, success=True):
+        try:
+            if success:
+                for _dum, column in self.columns:
+                    column.flush()
+                # ZipFile needs a seekable file, which stdout may not be,
+                # so stdout gets a copy of a zip in the temp dir.
+                if self.outfile == '-':
+                    zipname = os.path.join(self.tmpdir, 'export.npz')
+                else:
+                    zipname = self.outfile
+                with zipfile.ZipFile(zipname, 'w', allowZip64=True) as z:
+                    for filename, _dum in self.columns:
+                        z.write(filename, os.path.basename(filename))
+                if self.outfile == '-':
+                    f = open_output(self.outfile, 'wb')
+                    with open(zipname, 'rb') as z:
+                        shutil.copyfileobj(z, f)
+                    f.flush()
+        finally:
+            del self.columns
+            shutil.rmtree(self.tmpdir)
+
+
+class ParquetExporter(object):
+    '''Writes each window as a row group of the Parquet outfile.'''
+
+    def __init__(self, outfile, names, numrows):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet export requires pyarrow.")
+        self.pa = pa
+        self.names = ['time'] + names
+        schema = pa.schema(
+            [('time', pa.int64())] + [(name, pa.float64()) for name in names])
+        self.outfile = outfile
+        self.f = open_output(outfile, 'wb')
+        self.writer = pq.ParquetWriter(self.f, schema)
+
+    def write(self, times, data):
+        arrays = [self.pa.array(times.astype('int64'))]
+        arrays.extend(self.pa.array(values, from_pandas=True)
+                      for values in data)
+        self.writer.write_table(
+            self.pa.Table.from_arrays(arrays, names=self.names))
+
+    def close(self, success=True):
+        self.writer.close()
+        if self.outfile != '-':
+            self.f.close()
+
+
+EXPORTERS = {
+    'csv': CSVExporter,
+    'npz': NPZExporter,
+    'parquet': ParquetExporter
+}
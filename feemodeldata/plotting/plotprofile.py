@@ -4,7 +4,7 @@ import plotly.plotly as py
 from plotly.graph_objs import (Scatter, Figure, Layout, Data, YAxis, XAxis,
                                Line, Font)
 
-from feemodel.apiclient import client
+from feemodeldata.apisnapshot import client
 
 from feemodeldata.plotting import logger
 from feemodeldata.plotting.plotrrd import BASEDIR
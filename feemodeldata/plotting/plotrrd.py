@@ -1,16 +1,23 @@
 '''Plot the RRD data and also maybe some others.'''
 from __future__ import division
 
+import os
+import json
+import hashlib
 from time import time
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 
-import rrdtool
+import numpy as np
 import plotly.plotly as py
 from plotly.graph_objs import (YAxis, XAxis, Scatter, Data, Layout,
                                Line, Figure)
 
-from feemodeldata.util import retry
-from feemodeldata.rrdcollect import RRDFILE
+from feemodel.config import datadir
+
+from feemodeldata.util import retry, atomic_write
+from feemodeldata.decimate import DECIMATORS
+from feemodeldata.rrdcollect import get_backend
 from feemodeldata.plotting import logger
 
 BASEDIR = 'feemodel_RRD'
@@ -20,6 +27,32 @@ RRDGRAPH_SCHEMA = [
     (10800, 56, '3h'),  # Every 3 hours, for a week.
     (86400, 180, '1d'),  # Daily, for ~ half a year.
 ]
+# Cache of the series fetched by get_latest_datapoints, one file per
+# interval and CF.
+QUERYCACHEDIR = os.path.join(datadir, 'querycache')
+# Number of cached points, up to the last one with known values, to fetch
+# again, since they may have been fetched before all their samples were
+# written.
+REFETCH_POINTS = 2
+# State of the incrementally published figures.
+PLOTSTATEDIR = os.path.join(datadir, 'plotstate')
+# Fraction of maxpoints by which an incrementally extended figure may
+# outgrow its window before it is uploaded again in full.
+EXTEND_SLACK = 0.1
+# The resolution levels which are plotted with min/max envelopes, and the
+# consolidation functions fetched for them.
+BAND_RESNUMBERS = [2, 3]
+BAND_CFS = ['AVERAGE', 'MIN', 'MAX']
+# Fill colors of the envelopes of each trace.
+BAND_COLORS = [
+    'rgba(31,119,180,0.2)',
+    'rgba(255,127,14,0.2)',
+    'rgba(44,160,44,0.2)',
+    'rgba(214,39,40,0.2)',
+    'rgba(0,0,0,0.1)',
+    'rgba(0,0,0,0.1)',
+    'rgba(0,0,0,0.1)',
+]
 
 LAYOUT = Layout(
     title=('Required fee rate for given average wait time'),
@@ -52,57 +85,393 @@ LAYOUT = Layout(
 # #    else:
 # #        logger.info("Plotted {}".format(res))
 
-def plot_latest(resnumber, basedir=BASEDIR):
-    _dum0, _dum1, filename = RRDGRAPH_SCHEMA[resnumber]
-    rrdplot(*get_latest_datapoints(resnumber), filename=basedir+filename)
+def plot_latest(resnumber, basedir=BASEDIR, incremental=False):
+    _dum0, numpoints, filename = RRDGRAPH_SCHEMA[resnumber]
+    times, tracesdata, bands = get_latest_plotdata(resnumber)
+    rrdplot(times, tracesdata, filename=basedir+filename,
+            incremental=incremental, maxpoints=numpoints, bands=bands)
+
+
+def get_latest_plotdata(resnumber):
+    '''Get (times, tracesdata, bands) of a resolution level for rrdplot.
+
+    tracesdata is the AVERAGE data. bands is the MIN and MAX data if the
+    level is in BAND_RESNUMBERS, otherwise None.
+    '''
+    if resnumber in BAND_RESNUMBERS:
+        times, tracesdata = get_latest_datapoints(resnumber, cf=BAND_CFS)
+        return times, tracesdata[0], tracesdata[1:]
+    times, tracesdata = get_latest_datapoints(resnumber)
+    return times, tracesdata, None
 
 
 def plot_custom(starttime, endtime, interval,
-                cf="AVERAGE", filename="testing/customrrd"):
-    rrdplot(*get_datapoints(starttime, endtime, interval, cf=cf),
-            filename=filename)
+                cf="AVERAGE", filename="testing/customrrd",
+                numpoints=None, decimation='lttb'):
+    '''Plot a custom time range.
 
+    Each part of the range is served by the finest archive which covers
+    it (see get_datapoints_stitched). If numpoints is specified, each
+    trace is decimated to about numpoints points with the decimation
+    method ('lttb' or 'minmax', see feemodeldata.decimate), which bounds
+    the plot size whatever the range.
+    '''
+    times, tracesdata, segments = get_datapoints_stitched(
+        starttime, endtime, interval, cf=cf)
+    logger.info("Custom plot segments (start, end, resolution): {}".
+                format(segments))
+    rrdplot(times, tracesdata, filename=filename, numpoints=numpoints,
+            decimation=decimation)
+
+
+def get_latest_datapoints(resnumber, cf='AVERAGE', usecache=True):
+    '''Get the datapoints of a RRDGRAPH_SCHEMA resolution level.
 
-def get_latest_datapoints(resnumber, cf='AVERAGE'):
+    cf is a consolidation function, or a list of them, in which case they
+    are fetched together by get_datapoints_bands.
+
+    If usecache, the points are read from the query cache, and only the
+    points after the cached ones are fetched, along with the cached points
+    which may have been incomplete (see evict_querycache).
+    '''
     interval, numpoints, filename = RRDGRAPH_SCHEMA[resnumber]
     endtime = int(time()) // interval * interval
     starttime = endtime - interval*numpoints
-    return get_datapoints(starttime, endtime, interval, cf)
+    if isinstance(cf, (list, tuple)):
+        fetch = get_datapoints_bands
+        cfname = '-'.join(cf)
+    else:
+        fetch = get_datapoints
+        cfname = cf
+    if not usecache:
+        return fetch(starttime, endtime, interval, cf)
+
+    cachefile = os.path.join(
+        QUERYCACHEDIR, "{}_{}.npz".format(interval, cfname))
+    times, tracesdata = read_querycache(cachefile)
+    times, tracesdata = evict_querycache(times, tracesdata, starttime)
+    if len(times):
+        newtimes, newdata = fetch(times[-1], endtime, interval, cf)
+        times = np.concatenate([times, newtimes])
+        tracesdata = np.concatenate([tracesdata, newdata], axis=-1)
+    else:
+        times, tracesdata = fetch(starttime, endtime, interval, cf)
+    try:
+        write_querycache(cachefile, times, tracesdata)
+    except Exception:
+        logger.exception("Unable to write query cache.")
+    return times, tracesdata
+
+
+def read_querycache(cachefile):
+    '''Read (times, tracesdata) from a query cache file.
+
+    Returns empty arrays if the file is missing or unreadable.
+    '''
+    try:
+        with np.load(cachefile) as cached:
+            return cached['times'], cached['tracesdata']
+    except Exception:
+        return np.empty(0, dtype=int), np.empty((0, 0))
+
+
+def evict_querycache(times, tracesdata, starttime):
+    '''Drop the cached points which are not to be reused.
+
+    These are the points at or before starttime, and the points to fetch
+    again: the trailing points with no known values, which may not have
+    been written when they were fetched, and the last REFETCH_POINTS
+    points up to the last one with known values, which may have been
+    consolidated from incomplete samples.
+    '''
+    keep = times > starttime
+    if len(times):
+        known = ~np.isnan(tracesdata.reshape(-1, len(times))).all(axis=0)
+        knownidxs = np.flatnonzero(known)
+        if len(knownidxs):
+            keep[max(knownidxs[-1] + 1 - REFETCH_POINTS, 0):] = False
+        else:
+            keep[:] = False
+    return times[keep], tracesdata[..., keep]
+
+
+def write_querycache(cachefile, times, tracesdata):
+    cachedir = os.path.dirname(cachefile)
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+    with atomic_write(cachefile, "wb") as f:
+        np.savez(f, times=times, tracesdata=tracesdata)
 
 
 def get_datapoints(starttime, endtime, interval, cf='AVERAGE'):
-    timerange, datasources, datapoints = rrdtool.fetch(
-        RRDFILE,
-        cf,
-        '--resolution', str(interval),
-        '--start', str(starttime),
-        '--end', str(endtime)
-    )
+    '''Get the datapoints in the time range, at the specified interval.
+
+    Returns (times, tracesdata), where times is the array of point times,
+    and tracesdata is the (numtraces, numpoints) array of the datasources
+    other than the pdistance, with NaN for unknown. Data stored at a finer
+    resolution than interval is downsampled.
+    '''
+    timerange, datasources, columns = get_backend().fetch(
+        cf, starttime, endtime, interval)
     datastart, dataend, datainterval = timerange
     # Select all but the pdistance.
-    tracesdata = zip(*datapoints)[:-1]
-    times = range(datastart+datainterval, dataend+datainterval, datainterval)
+    tracesdata = np.array(columns[:-1], dtype=float)
+    times = np.arange(datastart+datainterval, dataend+datainterval,
+                      datainterval)
     if datainterval != interval:
         q, r = divmod(interval, datainterval)
         assert not r
         times = downsample(times, q, last)
-        tracesdata = map(
-            lambda datatrace: downsample(datatrace, q, average), tracesdata)
+        tracesdata = downsample(tracesdata, q, average)
     # Convert bytes/sec to bytes/decaminute.
-    tracesdata[5] = map(lambda rate: rate*600 if rate else None, tracesdata[5])
-    tracesdata[6] = map(lambda rate: rate*600 if rate else None, tracesdata[6])
+    tracesdata[5:7] *= 600
     return times, tracesdata
 
 
+def get_datapoints_bands(starttime, endtime, interval, cfs=BAND_CFS):
+    '''Get the datapoints of several consolidation functions at once.
+
+    Like get_datapoints, but the archives of all the cfs are read in one
+    backend fetch, and tracesdata is the (len(cfs), numtraces, numpoints)
+    array. When downsampling, the windows are taken once for all cfs, and
+    each cf's windows are consolidated with that cf.
+    '''
+    timerange, datasources, values = get_backend().fetch_multi(
+        cfs, starttime, endtime, interval)
+    datastart, dataend, datainterval = timerange
+    # Select all but the pdistance.
+    tracesdata = np.array(values[:, :-1], dtype=float)
+    times = datastart + datainterval*np.arange(1, tracesdata.shape[-1]+1)
+    if datainterval != interval:
+        q, r = divmod(interval, datainterval)
+        assert not r
+        times = downsample(times, q, last)
+        windows = downsample(tracesdata, q, lambda windows: windows)
+        tracesdata = np.array([
+            CONSOLIDATORS[cf](cfwindows)
+            for cf, cfwindows in zip(cfs, windows)])
+    # Convert bytes/sec to bytes/decaminute.
+    tracesdata[:, 5:7] *= 600
+    return times, tracesdata
+
+
+def get_datapoints_stitched(starttime, endtime, interval, cf='AVERAGE'):
+    '''Get the datapoints in the time range, each at the finest resolution.
+
+    Like get_datapoints, but instead of serving the whole range from the
+    one archive which covers all of it, the range is split into segments
+    by plan_segments, which are fetched in parallel and concatenated.
+    Returns (times, tracesdata, segments), where segments is the list of
+    (segstart, segend, resolution) of each segment, in time order.
+    '''
+    segments = plan_segments(starttime, endtime, interval, cf)
+    if not segments:
+        return np.empty(0, dtype=int), np.empty((7, 0)), segments
+    pool = ThreadPool(len(segments))
+    try:
+        results = [
+            pool.apply_async(get_datapoints, (segstart, segend, res, cf))
+            for segstart, segend, res in segments]
+        results = [result.get() for result in results]
+    finally:
+        pool.close()
+        pool.join()
+    # Drop any points which overlap the next segment.
+    segtimes = []
+    segdata = []
+    for idx, (times, tracesdata) in enumerate(results):
+        if idx + 1 < len(segments):
+            keep = times <= segments[idx+1][0]
+            times, tracesdata = times[keep], tracesdata[:, keep]
+        segtimes.append(times)
+        segdata.append(tracesdata)
+    return (np.concatenate(segtimes), np.concatenate(segdata, axis=1),
+            segments)
+
+
+def plan_segments(starttime, endtime, interval, cf='AVERAGE'):
+    '''Split the time range by the archive which serves each part.
+
+    The most recent part is served by the finest archive which covers it,
+    the part before that by the next finest archive, and so on. Each
+    segment's resolution is the archive interval, or interval if that is
+    coarser, and its start is aligned to the next segment's resolution,
+    so the segments abut. Returns a list of (segstart, segend, resolution)
+    in time order.
+    '''
+    archives = get_backend().get_archives(cf)
+    resolutions = []
+    for archiveinterval, _dum in archives:
+        # The resolution must be a multiple of the archive interval.
+        numpdps = max(-(-interval // archiveinterval), 1)
+        resolutions.append(numpdps*archiveinterval)
+    segments = []
+    segend = endtime
+    for idx, (_dum, firsttime) in enumerate(archives):
+        res = resolutions[idx]
+        if firsttime <= starttime or idx + 1 == len(archives):
+            # This archive serves the rest of the range.
+            segments.append((starttime - starttime % res, segend, res))
+            break
+        alignres = resolutions[idx+1]
+        if alignres == res:
+            # The next archive gives the same resolution and covers more.
+            continue
+        segstart = -(-firsttime // alignres) * alignres
+        if segstart < segend:
+            segments.append((segstart, segend, res))
+            segend = segstart
+    segments.reverse()
+    return segments
+
+
+def tolist(data):
+    '''Convert an array to (nested) lists, with None for NaN.'''
+    data = np.asarray(data)
+    if data.dtype.kind != 'f':
+        return data.tolist()
+    return np.where(np.isnan(data), None, data).tolist()
+
+
+def rrdplot(times, tracesdata, filename='test', incremental=False,
+            maxpoints=None, publisher=py, statedir=PLOTSTATEDIR,
+            numpoints=None, decimation='lttb', bands=None):
+    '''Plot the get_datapoints output.
+
+    If numpoints is specified, the traces are decimated (see get_traces).
+    If bands, the (2, numtraces, numpoints) array of MIN and MAX data, each
+    trace is drawn with a shaded min/max envelope.
+
+    In incremental mode, the time of the last published point and the
+    layout of each figure is kept in a state file in statedir, and only
+    the newer points are sent, using plotly's 'extend' fileopt. Trailing
+    points with no known values are held back until they are written.
+    The figure is uploaded in full, trimmed to its last maxpoints points,
+    if there is no state, if the layout has changed, or if extending would
+    make the figure longer than maxpoints by more than EXTEND_SLACK of it
+    (plotly can't drop points from the start of a trace).
+
+    publisher is the plotting service, an object with a plotly.plotly.plot
+    compatible plot method, e.g. a LocalPublisher for testing. Only the
+    uploads are retried (see publish_figure), so that a failure after an
+    'extend' upload doesn't send its points again.
+    '''
+    if not incremental:
+        fig = Figure(data=Data(get_traces(
+            times, tracesdata, numpoints=numpoints, decimation=decimation,
+            bands=bands)),
+            layout=LAYOUT)
+        publish_figure(publisher, fig, filename)
+        return
+
+    # Hold back the trailing points which have not been written yet.
+    numcomplete = len(times)
+    while numcomplete and np.isnan(tracesdata[:, numcomplete-1]).all():
+        numcomplete -= 1
+    times, tracesdata = times[:numcomplete], tracesdata[:, :numcomplete]
+    if bands is not None:
+        bands = bands[..., :numcomplete]
+    if not numcomplete:
+        return
+
+    layouthash = get_layouthash(bands=bands is not None)
+    statefile = os.path.join(
+        statedir, filename.replace('/', '_') + '.json')
+    state = read_plotstate(statefile)
+    if state is not None and state['layouthash'] == layouthash:
+        new = times > state['lasttime']
+        numpoints = state['numpoints'] + int(new.sum())
+        if (maxpoints is None or
+                numpoints <= maxpoints + max(int(maxpoints*EXTEND_SLACK), 1)):
+            if new.any():
+                fig = Figure(data=Data(get_traces(
+                    times[new], tracesdata[:, new], style=False,
+                    bands=None if bands is None else bands[..., new])))
+                publish_figure(publisher, fig, filename, fileopt='extend')
+                state.update(lasttime=int(times[-1]), numpoints=numpoints)
+                try:
+                    write_plotstate(statefile, state)
+                except Exception:
+                    # The stale state would extend the points again, so
+                    # drop it, for a full upload next time.
+                    if os.path.exists(statefile):
+                        os.remove(statefile)
+                    raise
+            return
+
+    if maxpoints is not None:
+        times, tracesdata = times[-maxpoints:], tracesdata[:, -maxpoints:]
+        if bands is not None:
+            bands = bands[..., -maxpoints:]
+    fig = Figure(data=Data(get_traces(times, tracesdata, bands=bands)),
+                 layout=LAYOUT)
+    publish_figure(publisher, fig, filename, fileopt='overwrite')
+    write_plotstate(statefile, {
+        'lasttime': int(times[-1]),
+        'numpoints': len(times),
+        'layouthash': layouthash
+    })
+
+
 @retry(wait=1, maxtimes=3, logger=logger)
-def rrdplot(times, tracesdata, filename='test'):
-    '''Plot based on specified time range.
+def publish_figure(publisher, fig, filename, fileopt='new'):
+    '''Upload the figure with the publisher, retrying on failure.'''
+    return publisher.plot(fig, filename=filename, fileopt=fileopt,
+                          auto_open=False)
 
-    starttime/endtime is unix time, interval is the point spacing in seconds.
+
+def get_traces(times, tracesdata, style=True, numpoints=None,
+               decimation='lttb', bands=None):
+    '''Get the list of Scatter traces of the get_datapoints output.
+
+    If style, the traces are named and styled. If numpoints is specified,
+    each trace is decimated to about numpoints points with the decimation
+    method in feemodeldata.decimate.DECIMATORS.
+
+    If bands, the (2, numtraces, numpoints) array of MIN and MAX data,
+    each trace is preceded by its MIN and MAX traces, the MAX one filled
+    down to the MIN one. The envelopes are decimated at the same points
+    as their trace.
     '''
+    x = [datetime.utcfromtimestamp(t) for t in tolist(times)]
+    if numpoints is None or len(times) <= numpoints:
+        allidxs = [slice(None)]*len(tracesdata)
+    else:
+        decimate = DECIMATORS[decimation]
+        allidxs = [decimate(times, tracedata, numpoints)
+                   for tracedata in tracesdata]
+    traces = []
+    envelopes = []
+    for i, (tracedata, idxs) in enumerate(zip(tracesdata, allidxs)):
+        tracex = x[idxs] if isinstance(idxs, slice) else [
+            x[idx] for idx in idxs]
+        traces.append(Scatter(x=tracex, y=tolist(tracedata[idxs])))
+        if bands is not None:
+            envelopes.append([
+                Scatter(x=tracex, y=tolist(bands[0, i][idxs])),
+                Scatter(x=tracex, y=tolist(bands[1, i][idxs]))])
+    if style:
+        style_traces(traces)
+        for (mintrace, maxtrace), color in zip(envelopes, BAND_COLORS):
+            for bandtrace in [mintrace, maxtrace]:
+                bandtrace.update(dict(
+                    mode='lines',
+                    line=Line(width=0),
+                    showlegend=False,
+                    hoverinfo='none'))
+            maxtrace.update(dict(fill='tonexty', fillcolor=color))
+        for trace, (mintrace, maxtrace) in zip(traces, envelopes):
+            if 'xaxis' in trace:
+                for bandtrace in [mintrace, maxtrace]:
+                    bandtrace.update(dict(xaxis='x2', yaxis='y2'))
+    if bands is None:
+        return traces
+    return [tr for trace, envelope in zip(traces, envelopes)
+            for tr in envelope + [trace]]
+
 
-    x = [datetime.utcfromtimestamp(t) for t in times]
-    traces = [Scatter(x=x, y=tracedata) for tracedata in tracesdata]
+def style_traces(traces):
+    '''Name and style the get_datapoints traces.'''
     names = ['12 min', '20 min', '30 min', '60 min']
     for i, name in enumerate(names):
         traces[i].update(dict(name=name))
@@ -124,29 +493,132 @@ def rrdplot(times, tracesdata, filename='test'):
         yaxis='y2',
         line=Line(color='black', dash='dash')
     ))
-    data = Data(traces)
-    fig = Figure(data=data, layout=LAYOUT)
-    py.plot(fig, filename=filename, auto_open=False)
 
 
-def downsample(data, n, cf):
-    '''Downsample data by factor of n with consolidation function cf.'''
-    datadown = [data[i*n:(i+1)*n] for i in range(len(data)//n)]
-    return map(cf, datadown)
+def get_layouthash(bands=False):
+    '''Get a hash of the figure layout and trace styles.
+
+    If bands, the styles include those of the min/max envelopes.
+    '''
+    styles = [
+        dict((key, value) for key, value in trace.items()
+             if key not in ('x', 'y'))
+        for trace in get_traces(
+            np.empty(0, dtype=int), np.empty((7, 0)),
+            bands=np.empty((2, 7, 0)) if bands else None)]
+    return hashlib.md5(json.dumps(
+        [LAYOUT, styles], sort_keys=True).encode('utf-8')).hexdigest()
 
 
-def average(data):
-    '''Consolidation function which uses the mean.'''
-    datatrue = [d for d in data if d is not None]
-    if len(datatrue) / len(data) < 0.5:
+def read_plotstate(statefile):
+    try:
+        with open(statefile, "r") as f:
+            return json.load(f)
+    except Exception:
         return None
-    else:
-        return sum(datatrue) / len(datatrue)
 
 
-def last(data):
-    '''Consolidation function which takes the last point.'''
-    for d in reversed(data):
-        if d is not None:
-            return d
-    return None
+def write_plotstate(statefile, state):
+    if not os.path.exists(os.path.dirname(statefile)):
+        os.makedirs(os.path.dirname(statefile))
+    with atomic_write(statefile) as f:
+        json.dump(state, f)
+
+
+class LocalPublisher(object):
+    '''Stand-in for the plotly service, which stores figures locally.
+
+    Each figure is stored as JSON in directory, and the 'extend' fileopt
+    appends the points of each trace to the stored trace.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def plot(self, fig, filename, fileopt='new', auto_open=False):
+        figfile = self.get_figfile(filename)
+        fig = json.loads(json.dumps(fig, default=str))
+        if fileopt == 'extend':
+            stored = self.read(filename)
+            for storedtrace, trace in zip(stored['data'], fig['data']):
+                storedtrace['x'].extend(trace['x'])
+                storedtrace['y'].extend(trace['y'])
+            fig = stored
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        with atomic_write(figfile) as f:
+            json.dump(fig, f)
+        return figfile
+
+    def read(self, filename):
+        with open(self.get_figfile(filename), "r") as f:
+            return json.load(f)
+
+    def get_figfile(self, filename):
+        return os.path.join(
+            self.directory, filename.replace('/', '_') + '.json')
+
+
+def downsample(data, n, cf):
+    '''Downsample data by factor of n with consolidation function cf.
+
+    data is an array whose last axis is time. It is reshaped so that each
+    window of n points is along a new last axis, which cf reduces. Points
+    after the last full window are dropped.
+    '''
+    numwindows = data.shape[-1] // n
+    windows = data[..., :numwindows*n].reshape(
+        data.shape[:-1] + (numwindows, n))
+    return cf(windows)
+
+
+def average(windows):
+    '''Consolidation function which uses the mean.
+
+    The mean is of the known points, and is NaN if less than half of the
+    window's points are known.
+    '''
+    known = ~np.isnan(windows)
+    numknown = known.sum(axis=-1)
+    total = np.where(known, windows, 0).sum(axis=-1)
+    result = np.empty(total.shape)
+    result.fill(np.nan)
+    valid = numknown >= 0.5*windows.shape[-1]
+    result[valid] = total[valid] / numknown[valid]
+    return result
+
+
+def minimum(windows):
+    '''Consolidation function which takes the min of the known points.'''
+    known = ~np.isnan(windows)
+    result = np.where(known, windows, np.inf).min(axis=-1)
+    result[~known.any(axis=-1)] = np.nan
+    return result
+
+
+def maximum(windows):
+    '''Consolidation function which takes the max of the known points.'''
+    known = ~np.isnan(windows)
+    result = np.where(known, windows, -np.inf).max(axis=-1)
+    result[~known.any(axis=-1)] = np.nan
+    return result
+
+
+def last(windows):
+    '''Consolidation function which takes the last known point.'''
+    if windows.dtype.kind != 'f':
+        return windows[..., -1]
+    known = ~np.isnan(windows)
+    lastidx = windows.shape[-1] - 1 - np.argmax(known[..., ::-1], axis=-1)
+    result = np.take_along_axis(
+        windows, lastidx[..., np.newaxis], axis=-1)[..., 0]
+    result[~known.any(axis=-1)] = np.nan
+    return result
+
+
+# The downsampling consolidation function of each RRD CF.
+CONSOLIDATORS = {
+    'AVERAGE': average,
+    'MIN': minimum,
+    'MAX': maximum
+}
@@ -0,0 +1,120 @@
+'''Publish the latest RRD data to all sinks from a single fetch.'''
+from __future__ import division
+
+import os
+import csv
+import json
+import threading
+from time import time
+from multiprocessing.pool import ThreadPool
+
+from feemodeldata.rrdcollect import DSNAMES
+from feemodeldata.util import atomic_write
+from feemodeldata.plotting import logger
+from feemodeldata.plotting.plotrrd import (BASEDIR, RRDGRAPH_SCHEMA,
+                                           get_latest_plotdata, rrdplot,
+                                           tolist)
+
+# Max number of sink pushes in flight at once.
+MAX_PUBLISH_WORKERS = 4
+
+
+def publish(resnumbers, basedir=BASEDIR, credentialsfile=None,
+            outdir=None, fmt='json', incremental=False):
+    '''Fetch each resolution level once and push it to every sink.
+
+    The sinks are the plotly figure, the spreadsheet worksheet if
+    credentialsfile is specified, and a local fmt ('json' or 'csv') file
+    in outdir if it is specified. The pushes run concurrently.
+
+    The plotly figure is plotted as by plotrrd.plot_latest, with min/max
+    envelopes for the BAND_RESNUMBERS levels, and incrementally if
+    incremental. The other sinks get the AVERAGE data.
+
+    Returns a list of (resnumber, sink, elapsed, error) for each push,
+    where error is None if the push succeeded.
+    '''
+    spreadsheet = None
+    if credentialsfile is not None:
+        from feemodeldata.plotting.pushtables import get_spreadsheet
+        spreadsheet = get_spreadsheet(credentialsfile)
+    # The gspread client is not thread-safe.
+    sheetlock = threading.Lock()
+
+    tasks = []
+    for resnumber in resnumbers:
+        _dum0, numpoints, filename = RRDGRAPH_SCHEMA[resnumber]
+        times, tracesdata, bands = get_latest_plotdata(resnumber)
+        tasks.append((resnumber, 'plotly', push_plotly,
+                      (basedir+filename, times, tracesdata, bands,
+                       numpoints, incremental)))
+        if spreadsheet is not None:
+            tasks.append((resnumber, 'sheets', push_sheet,
+                          (sheetlock, spreadsheet, resnumber, times,
+                           tracesdata)))
+        if outdir is not None:
+            tasks.append((resnumber, 'file', write_artifact,
+                          (os.path.join(outdir, filename), fmt, times,
+                           tracesdata)))
+
+    pool = ThreadPool(MAX_PUBLISH_WORKERS)
+    try:
+        results = [
+            (resnumber, sink,
+             pool.apply_async(_timed_push, (resnumber, sink, fn, args)))
+            for resnumber, sink, fn, args in tasks]
+        return [(resnumber, sink) + result.get()
+                for resnumber, sink, result in results]
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _timed_push(resnumber, sink, fn, args):
+    '''Call fn(*args) and return (elapsed, error).'''
+    starttime = time()
+    try:
+        fn(*args)
+    except Exception as e:
+        logger.exception("Exception in publishing {} to {}.".
+                         format(RRDGRAPH_SCHEMA[resnumber][2], sink))
+        error = e
+    else:
+        error = None
+    return time() - starttime, error
+
+
+def push_plotly(filename, times, tracesdata, bands, maxpoints,
+                incremental):
+    rrdplot(times, tracesdata, filename=filename, incremental=incremental,
+            maxpoints=maxpoints, bands=bands)
+
+
+def push_sheet(sheetlock, spreadsheet, resnumber, times, tracesdata):
+    from feemodeldata.plotting.pushtables import push_rrdtable
+    with sheetlock:
+        push_rrdtable(spreadsheet, resnumber, times, tracesdata)
+
+
+def write_artifact(basename, fmt, times, tracesdata):
+    '''Write the data to basename.json or basename.csv.
+
+    The file is written atomically, so readers never see a partial file.
+    '''
+    names = DSNAMES[:len(tracesdata)]
+    filename = "{}.{}".format(basename, fmt)
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    with atomic_write(filename) as f:
+        if fmt == 'json':
+            data = dict(zip(names, tolist(tracesdata)))
+            data['times'] = tolist(times)
+            json.dump(data, f)
+        elif fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(['time'] + names)
+            for row in zip(tolist(times), *tolist(tracesdata)):
+                writer.writerow(['' if d is None else d for d in row])
+        else:
+            raise ValueError("Unknown format {}.".format(fmt))
@@ -3,12 +3,41 @@ from __future__ import division
 import json
 import sys
 import os
+import hashlib
+import threading
+from time import time
+from calendar import timegm
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 
 import gspread
 from oauth2client.client import SignedJwtAssertionCredentials
 
+from feemodel.config import datadir
+
+from feemodeldata.util import retry, atomic_write
+from feemodeldata.plotting import logger
+
 SPREADSHEET = "feemodeldata"
+# Snapshots of the last pushed table of each worksheet, against which the
+# next push is diffed.
+TABLESNAPSHOTDIR = os.path.join(datadir, 'tablesnapshots')
+# Age in seconds after which a snapshot is not trusted, so that manual
+# edits to the sheet are eventually overwritten.
+TABLESNAPSHOT_MAXAGE = 86400
+# Max number of ranges to read for a diff push; if more rows runs have
+# changed, their bounding range is pushed instead.
+MAX_DIFF_RANGES = 10
+# Max number of rows sent per update_cells request.
+PUSH_BLOCK_ROWS = 500
+# Cache of the access token, which is reused until it expires.
+TOKENCACHEFILE = os.path.join(datadir, 'sheetstoken.json')
+# Seconds before its expiry at which a token is no longer used.
+TOKEN_EXPIRY_MARGIN = 300
+
+# (credentialsfile, spreadsheet title) -> (credentials, client, spreadsheet)
+_spreadsheets = {}
+_spreadsheetslock = threading.Lock()
 
 
 def push_timestr(worksheet):
@@ -18,43 +47,143 @@ def push_timestr(worksheet):
 
 
 def get_credentials(credentialsfile):
+    '''Get the credentials, with the cached access token if it is valid.'''
     with open(credentialsfile, "r") as f:
         json_key = json.load(f)
     scope = ['https://spreadsheets.google.com/feeds']
     credentials = SignedJwtAssertionCredentials(
         json_key['client_email'], json_key['private_key'], scope)
+    token = read_tokencache()
+    if (token is not None and
+            token['client_email'] == json_key['client_email'] and
+            token['token_expiry'] - TOKEN_EXPIRY_MARGIN > time()):
+        credentials.access_token = token['access_token']
+        credentials.token_expiry = datetime.utcfromtimestamp(
+            token['token_expiry'])
     return credentials
 
 
 def get_spreadsheet(credentialsfile):
-    spreadsheet = os.environ.get("FEEMODEL_SPREADSHEET")
-    if spreadsheet is None:
-        spreadsheet = SPREADSHEET
-    gc = gspread.authorize(get_credentials(credentialsfile))
-    return gc.open(spreadsheet)
+    '''Get the spreadsheet.
+
+    The authorized client and spreadsheet handle are kept for the life of
+    the process, and the access token is cached in TOKENCACHEFILE, so that
+    a new token is only requested when the cached one expires.
+    '''
+    title = os.environ.get("FEEMODEL_SPREADSHEET")
+    if title is None:
+        title = SPREADSHEET
+    key = (os.path.abspath(credentialsfile), title)
+    with _spreadsheetslock:
+        if key in _spreadsheets:
+            credentials, gc, spreadsheet = _spreadsheets[key]
+            if not is_token_expiring(credentials):
+                return spreadsheet
+            # Refreshes the token and the client's auth header.
+            credentials.token_expiry = datetime.utcnow()
+            gc.login()
+        else:
+            credentials = get_credentials(credentialsfile)
+            gc = gspread.authorize(credentials)
+            spreadsheet = gc.open(title)
+        write_tokencache(credentials)
+        _spreadsheets[key] = (credentials, gc, spreadsheet)
+        return spreadsheet
+
+
+def is_token_expiring(credentials):
+    if credentials.token_expiry is None:
+        return False
+    return (timegm(credentials.token_expiry.utctimetuple()) -
+            TOKEN_EXPIRY_MARGIN <= time())
+
+
+def read_tokencache():
+    try:
+        with open(TOKENCACHEFILE, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def write_tokencache(credentials):
+    if credentials.token_expiry is None:
+        return
+    token = {
+        'client_email': credentials.service_account_name,
+        'access_token': credentials.access_token,
+        'token_expiry': timegm(credentials.token_expiry.utctimetuple())
+    }
+    try:
+        # The token grants access to the spreadsheet, so keep it private.
+        with atomic_write(TOKENCACHEFILE, perms=0o600) as f:
+            json.dump(token, f)
+    except Exception:
+        # The token is requested anew next time.
+        pass
 
 
 def pushrrd(credentialsfile, resnumber):
     from feemodeldata.plotting.plotrrd import get_latest_datapoints as getdata
     spreadsheet = get_spreadsheet(credentialsfile)
+    t, data = getdata(resnumber)
+    push_rrdtable(spreadsheet, resnumber, t, data)
+
+
+def push_rrdtable(spreadsheet, resnumber, t, data):
+    '''Push the get_latest_datapoints output of a resolution level.'''
+    from feemodeldata.plotting.plotrrd import tolist
     WORKSHEETNAMES = ["1m", "30m", "3h", "1d"]
     worksheet = spreadsheet.worksheet(WORKSHEETNAMES[resnumber])
-    t, data = getdata(resnumber)
-    assert len(t) == len(data[0])
-    data.insert(0, t)
+    assert len(t) == data.shape[1]
+    data = tolist(data)
+    data.insert(0, tolist(t))
     pushtable(worksheet, data)
 
 
+class PushError(Exception):
+    '''Raised if some worksheets failed to push.'''
+
+    def __init__(self, errors):
+        self.errors = errors
+        super(PushError, self).__init__(
+            "Failed to push {}.".format(", ".join(sorted(errors))))
+
+
 def pushprofile(credentialsfile):
+    '''Push the profile tables.
+
+    The graphs are fetched from the API concurrently, and the worksheets
+    are pushed one at a time as the graphs arrive, since the gspread
+    client is not thread-safe. A failing worksheet doesn't stop the
+    others: the failures are logged, and then raised together as a
+    PushError, in which case the update time is not pushed.
+    '''
     import feemodeldata.plotting.plotprofile as profile
     spreadsheet = get_spreadsheet(credentialsfile)
+    graphtypes = ['waits', 'mempool', 'tx', 'pools']
 
-    for graphtype in ['waits', 'mempool', 'tx', 'pools']:
-        worksheet = spreadsheet.worksheet("profile_{}".format(graphtype))
-        funcname = "get_{}graph".format(graphtype)
-        trace = getattr(profile, funcname)()
-        table_cols = [trace['x'], trace['y']]
-        pushtable(worksheet, table_cols)
+    fetchpool = ThreadPool(len(graphtypes))
+    try:
+        traces = [(graphtype, fetchpool.apply_async(
+            getattr(profile, "get_{}graph".format(graphtype))))
+            for graphtype in graphtypes]
+        errors = {}
+        for graphtype, trace in traces:
+            try:
+                worksheet = spreadsheet.worksheet(
+                    "profile_{}".format(graphtype))
+                trace = trace.get()
+                pushtable(worksheet, [trace['x'], trace['y']])
+            except Exception as e:
+                logger.exception("Exception in pushing profile_{}.".
+                                 format(graphtype))
+                errors["profile_{}".format(graphtype)] = e
+    finally:
+        fetchpool.close()
+        fetchpool.join()
+    if errors:
+        raise PushError(errors)
 
     worksheet = spreadsheet.worksheet("profile_updatetime")
     push_timestr(worksheet)
@@ -81,7 +210,7 @@ def pushmining(credentialsfile):
 
 
 def pushpvals(credentialsfile):
-    from feemodel.apiclient import client
+    from feemodeldata.apisnapshot import client
     p = client.get_prediction()['pval_ecdf']
     spreadsheet = get_spreadsheet(credentialsfile)
     worksheet = spreadsheet.worksheet("pvals")
@@ -91,18 +220,188 @@ def pushpvals(credentialsfile):
     push_timestr(worksheet)
 
 
-def pushtable(worksheet, table_cols):
+def pushtable(worksheet, table_cols, diff=True, blockrows=PUSH_BLOCK_ROWS):
+    '''Push the table columns to the worksheet, below the header row.
+
+    If diff, only the rows which differ from the last pushed table are
+    sent, as kept in a snapshot in TABLESNAPSHOTDIR. The full table is
+    pushed if the snapshot is missing, doesn't match the worksheet's
+    shape, or is older than TABLESNAPSHOT_MAXAGE. The worksheet is only
+    resized if the number of rows has changed.
+
+    The rows are sent in blocks of up to blockrows rows, each with its own
+    range read and update_cells request, retried independently. The
+    blocks still to send are kept in a cursor file next to the snapshot,
+    so that if the push fails, pushing the same table again resumes from
+    the failed block.
+
+    The rows are built from table_cols as they are needed, and the hash
+    and snapshot are written row by row, so that beyond table_cols and
+    the previous snapshot, only one block's rows are held at a time.
+    '''
     numcols = len(table_cols)
     numrows = len(table_cols[0])
-    worksheet.resize(rows=numrows+1)
-    endcell = worksheet.get_addr_int(numrows+1, numcols)
-    cell_list = worksheet.range('A2:' + endcell)
-    table_list = [col[i] for i in range(numrows) for col in table_cols]
-    for cell, cellvalue in zip(cell_list, table_list):
-        cell.value = cellvalue
+    tablehash = get_tablehash(table_cols)
+    snapshotfile = get_snapshotfile(worksheet)
+    cursorfile = get_snapshotfile(worksheet, suffix='cursor')
+    cursor = read_tablesnapshot(cursorfile)
+    if (cursor is not None and cursor['tablehash'] == tablehash and
+            worksheet.row_count == numrows + 1):
+        blocks = cursor['blocks']
+        logger.info("Resuming push of {} at block {}.".format(
+            worksheet.title, cursor['numblocks'] - len(blocks)))
+    else:
+        snapshot = read_tablesnapshot(snapshotfile) if diff else None
+        if not (snapshot is not None and
+                snapshot['numcols'] == numcols and
+                len(snapshot['rows']) + 1 == worksheet.row_count and
+                time() - snapshot['time'] < TABLESNAPSHOT_MAXAGE):
+            snapshot = None
+        if worksheet.row_count != numrows + 1:
+            worksheet.resize(rows=numrows+1)
+        if snapshot is None:
+            ranges = [(0, numrows)] if numrows else []
+        else:
+            ranges = get_changed_ranges(snapshot['rows'],
+                                        iter_rows(table_cols))
+        blocks = get_blocks(ranges, blockrows)
+        if blocks and os.path.exists(snapshotfile):
+            # Until the push completes, the sheet doesn't match it.
+            os.remove(snapshotfile)
+        cursor = {'tablehash': tablehash, 'numblocks': len(blocks)}
+
+    for idx, block in enumerate(blocks):
+        cursor['blocks'] = blocks[idx:]
+        write_tablesnapshot(cursorfile, cursor)
+        push_block(worksheet, table_cols, block)
+    if os.path.exists(cursorfile):
+        os.remove(cursorfile)
+    write_tablesnapshot(snapshotfile, {
+        'time': time(),
+        'numcols': numcols,
+    }, rows=(get_rowjson(table_cols, idx) for idx in range(numrows)))
+
+
+def get_rowjson(table_cols, idx):
+    return json.dumps([col[idx] for col in table_cols])
+
+
+def iter_rows(table_cols):
+    '''Iterate over the table rows, one at a time.
+
+    The rows are round tripped through JSON, so that they compare equal
+    to the snapshot rows.
+    '''
+    for idx in range(len(table_cols[0])):
+        yield json.loads(get_rowjson(table_cols, idx))
+
+
+def get_tablehash(table_cols):
+    '''Get the hash of the table, computed row by row.'''
+    tablehash = hashlib.md5()
+    for idx in range(len(table_cols[0])):
+        tablehash.update(get_rowjson(table_cols, idx).encode('utf-8'))
+        tablehash.update(b'\n')
+    return tablehash.hexdigest()
+
+
+@retry(wait=1, maxtimes=3, logger=logger)
+def push_block(worksheet, table_cols, block):
+    '''Push the table rows in the block's [startrow, endrow) ranges.
+
+    The rows are built from the columns here, so that only a block's rows
+    are held at a time.
+    '''
+    numcols = len(table_cols)
+    cell_list = []
+    for startrow, endrow in block:
+        rows = [json.loads(get_rowjson(table_cols, idx))
+                for idx in range(startrow, endrow)]
+        # Row i of the table is row i+2 of the sheet.
+        cells = worksheet.range('A{}:{}'.format(
+            startrow+2, worksheet.get_addr_int(endrow+1, numcols)))
+        for cell in cells:
+            cell.value = rows[cell.row-2-startrow][cell.col-1]
+        cell_list.extend(cells)
     worksheet.update_cells(cell_list)
 
 
+def get_blocks(ranges, blockrows):
+    '''Pack the [startrow, endrow) ranges into blocks of <= blockrows rows.
+
+    Ranges longer than blockrows are split. Returns a list of blocks, each
+    a list of [startrow, endrow] ranges.
+    '''
+    blocks = []
+    numblockrows = blockrows
+    for startrow, endrow in ranges:
+        while startrow < endrow:
+            if numblockrows == blockrows:
+                blocks.append([])
+                numblockrows = 0
+            n = min(endrow - startrow, blockrows - numblockrows)
+            blocks[-1].append([startrow, startrow + n])
+            numblockrows += n
+            startrow += n
+    return blocks
+
+
+def get_changed_ranges(oldrows, rows):
+    '''Get the [startrow, endrow) ranges of rows which differ from oldrows.
+
+    rows can be any iterable of rows. At most MAX_DIFF_RANGES ranges are
+    returned; if there are more runs of changed rows, their bounding range
+    is returned.
+    '''
+    changed = [idx >= len(oldrows) or row != oldrows[idx]
+               for idx, row in enumerate(rows)]
+    ranges = []
+    for idx, rowchanged in enumerate(changed):
+        if not rowchanged:
+            continue
+        if ranges and ranges[-1][1] == idx:
+            ranges[-1][1] = idx + 1
+        else:
+            ranges.append([idx, idx + 1])
+    if len(ranges) > MAX_DIFF_RANGES:
+        ranges = [[ranges[0][0], ranges[-1][1]]]
+    return [tuple(r) for r in ranges]
+
+
+def get_snapshotfile(worksheet, suffix='snapshot'):
+    return os.path.join(TABLESNAPSHOTDIR, "{}_{}.{}.json".format(
+        worksheet.spreadsheet.id, worksheet.id, suffix))
+
+
+def read_tablesnapshot(snapshotfile):
+    try:
+        with open(snapshotfile, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def write_tablesnapshot(snapshotfile, snapshot, rows=None):
+    '''Write the snapshot dict.
+
+    If rows, an iterable of JSON encoded rows, they are written one at a
+    time as the snapshot's 'rows' list.
+    '''
+    if not os.path.exists(TABLESNAPSHOTDIR):
+        os.makedirs(TABLESNAPSHOTDIR)
+    with atomic_write(snapshotfile) as f:
+        if rows is None:
+            json.dump(snapshot, f)
+            return
+        f.write(json.dumps(snapshot)[:-1])
+        f.write(', "rows": [' if snapshot else '"rows": [')
+        for idx, rowjson in enumerate(rows):
+            if idx:
+                f.write(', ')
+            f.write(rowjson)
+        f.write(']}')
+
+
 if __name__ == "__main__":
     # For testing only.
     credentialsfile = sys.argv[1]
@@ -6,29 +6,60 @@ import rrdtool
 import threading
 import logging
 import logging.handlers
+from collections import deque
 from time import time, ctime
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 
 import click
+import numpy as np
 
 from feemodel.config import datadir
 from feemodel.util import StoppableThread
-from feemodel.apiclient import APIClient
+
+from feemodeldata.apisession import session
+from feemodeldata.rrdfile import RRDFile
+from feemodeldata.rrdjournal import RRDJournal, FLUSH_INTERVAL
+from feemodeldata.storage import ColumnarStore
+from feemodeldata.metrics import MetricsRegistry, MetricsServer, METRICS_PORT
 
 STEP = 60
+# Max seconds between updates before a datasource becomes unknown.
+HEARTBEAT = 3*STEP
+# Confirmation times in minutes of the fee estimate datasources.
+CONFTIMES = [12, 20, 30, 60]
+# Max number of API calls in flight at once.
+MAX_API_WORKERS = 8
+# Deadline in seconds for each API call, from the time it starts. A call
+# which hasn't started within this time of being issued also misses it.
+API_CALL_TIMEOUT = 30
 RRDFILE = os.environ.get("FEEMODEL_RRDFILE")
 if RRDFILE is None:
     RRDFILE = os.path.join(datadir, 'feedata.rrd')
 RRDLOGFILE = os.path.join(datadir, 'rrd.log')
+# Address of an rrdcached daemon through which to route RRD updates and
+# fetches, e.g. unix:/var/run/rrdcached.sock. RRDFILE must then be a path
+# that the daemon can access.
+RRDCACHED = os.environ.get("FEEMODEL_RRDCACHED")
+# Storage backend for the collected data: 'rrd' (RRDFILE) or 'columnar'
+# (STOREDIR, see feemodeldata.storage).
+STORAGE = os.environ.get("FEEMODEL_STORAGE")
+if STORAGE is None:
+    STORAGE = 'rrd'
+STOREDIR = os.environ.get("FEEMODEL_STOREDIR")
+if STOREDIR is None:
+    STOREDIR = os.path.join(datadir, 'feedata.store')
 DATASOURCES = [
-    "DS:fee12:GAUGE:{}:0:U".format(str(3*STEP)),
-    "DS:fee20:GAUGE:{}:0:U".format(str(3*STEP)),
-    "DS:fee30:GAUGE:{}:0:U".format(str(3*STEP)),
-    "DS:fee60:GAUGE:{}:0:U".format(str(3*STEP)),
-    "DS:mempoolsize:GAUGE:{}:0:U".format(str(3*STEP)),
-    "DS:txbyterate:GAUGE:{}:0:U".format(str(3*STEP)),
-    "DS:capacity:GAUGE:{}:0:U".format(str(3*STEP)),
-    "DS:pdistance:GAUGE:{}:0:1".format(str(3*STEP))
+    "DS:fee12:GAUGE:{}:0:U".format(str(HEARTBEAT)),
+    "DS:fee20:GAUGE:{}:0:U".format(str(HEARTBEAT)),
+    "DS:fee30:GAUGE:{}:0:U".format(str(HEARTBEAT)),
+    "DS:fee60:GAUGE:{}:0:U".format(str(HEARTBEAT)),
+    "DS:mempoolsize:GAUGE:{}:0:U".format(str(HEARTBEAT)),
+    "DS:txbyterate:GAUGE:{}:0:U".format(str(HEARTBEAT)),
+    "DS:capacity:GAUGE:{}:0:U".format(str(HEARTBEAT)),
+    "DS:pdistance:GAUGE:{}:0:1".format(str(HEARTBEAT))
 ]
+DSNAMES = [ds.split(':')[1] for ds in DATASOURCES]
 RRA = [
     "RRA:AVERAGE:0.5:1:10080",  # 1 week of 1 min data
     "RRA:AVERAGE:0.5:180:8760",  # 3 years of 3 hour data
@@ -42,10 +73,10 @@ RRA = [
 logger = logging.getLogger(__name__)
 
 
-def create_rrd(starttime):
+def create_rrd(starttime, rrdfile=RRDFILE):
     '''Create the RRD.'''
     rrdtool.create(
-        RRDFILE,
+        rrdfile,
         '--start', str(starttime),
         '--step', str(STEP),
         '--no-overwrite',
@@ -54,31 +85,206 @@ def create_rrd(starttime):
     )
 
 
+def daemon_args():
+    '''Get the rrdtool args for going through rrdcached, if configured.'''
+    return ['--daemon', RRDCACHED] if RRDCACHED else []
+
+
+def flush_rrd(rrdfile=RRDFILE):
+    '''Flush rrdcached's pending updates of rrdfile, if configured.
+
+    Call before reading rrdfile directly.
+    '''
+    if RRDCACHED:
+        rrdtool.flushcached('--daemon', RRDCACHED, rrdfile)
+
+
+def format_update(updatetime, *args):
+    '''Get the rrdtool update string, with None values as unknown.'''
+    args = ['U' if arg is None else arg for arg in args]
+    return "{}:{}:{}:{}:{}:{}:{}:{}:{}".format(updatetime, *args)
+
+
+def fetch_rrd(cf, starttime, endtime, resolution=None, rrdfile=RRDFILE,
+              cached=True):
+    '''Fetch from rrdfile.
+
+    Returns (timerange, dsnames, columns) as in rrdtool.fetch, except that
+    columns is a list of one float array per datasource, with NaN for
+    unknown. The file is read directly with RRDFile if possible, and with
+    rrdtool.fetch otherwise, through rrdcached if configured and cached.
+    '''
+    try:
+        return RRDFile(rrdfile).fetch(cf, starttime, endtime, resolution)
+    except (IOError, OSError, ValueError):
+        # The file can't be read directly, e.g. it is only accessible to
+        # rrdcached, or it is in a format the reader doesn't know.
+        pass
+    args = ['--start', str(starttime), '--end', str(endtime)]
+    if resolution is not None:
+        args.extend(['--resolution', str(resolution)])
+    if cached:
+        args.extend(daemon_args())
+    timerange, dsnames, datapoints = rrdtool.fetch(rrdfile, cf, *args)
+    values = np.array(datapoints, dtype=float).reshape(
+        len(datapoints), len(dsnames))
+    return timerange, dsnames, list(values.T)
+
+
 def update_rrd(updatetime, *args):
     '''Update the RRD.'''
-    updatestr = "{}:{}:{}:{}:{}:{}:{}:{}:{}".format(updatetime, *args)
-    rrdtool.update(RRDFILE, updatestr)
-    logger.info("RRD updated with {}".format(updatestr))
+    RRDBackend().update([(updatetime, args)])
+
+
+def get_backend():
+    '''Get the configured storage backend.'''
+    if STORAGE == 'columnar':
+        return ColumnarStore(STOREDIR, DATASOURCES, RRA, STEP)
+    if STORAGE != 'rrd':
+        raise ValueError("Unknown storage backend {}.".format(STORAGE))
+    return RRDBackend()
+
+
+class RRDBackend(object):
+    '''Storage backend which uses the RRD.
+
+    Has the same interface as feemodeldata.storage.ColumnarStore.
+    '''
+
+    def __init__(self, rrdfile=RRDFILE):
+        self.rrdfile = rrdfile
+        self.path = rrdfile
+
+    def exists(self):
+        return os.path.exists(self.rrdfile)
+
+    def create(self, starttime):
+        create_rrd(starttime, rrdfile=self.rrdfile)
+
+    def last(self):
+        flush_rrd(self.rrdfile)
+        return rrdtool.last(self.rrdfile)
+
+    def update(self, samples):
+        '''Update the RRD with a list of (updatetime, values) samples.'''
+        updatestrs = [format_update(updatetime, *values)
+                      for updatetime, values in samples]
+        if not updatestrs:
+            return
+        rrdtool.update(self.rrdfile, *(daemon_args() + updatestrs))
+        if len(updatestrs) == 1:
+            logger.info("RRD updated with {}".format(updatestrs[0]))
+        else:
+            logger.info("RRD updated with {} samples up to {}".
+                        format(len(updatestrs), updatestrs[-1]))
+
+    def get_archives(self, cf):
+        '''Get the archives with consolidation function cf.
+
+        Returns a list of (interval, firsttime) sorted by interval, where
+        firsttime is the time of the oldest row still in the archive.
+        '''
+        lastupdate = self.last()
+        archives = []
+        for rra in RRA:
+            _dum, rracf, _dum, pdp_per_row, numrows = rra.split(':')
+            if rracf != cf:
+                continue
+            interval = int(pdp_per_row)*STEP
+            lastrow = lastupdate - lastupdate % interval
+            archives.append((interval, lastrow - (int(numrows)-1)*interval))
+        return sorted(archives)
+
+    def fetch(self, cf, starttime, endtime, resolution=None):
+        '''Fetch from the RRD (see fetch_rrd).'''
+        flush_rrd(self.rrdfile)
+        return fetch_rrd(cf, starttime, endtime, resolution,
+                         rrdfile=self.rrdfile)
+
+    def fetch_multi(self, cfs, starttime, endtime, resolution=None):
+        '''Fetch the data of several consolidation functions at once.
+
+        All the archives are read by a single rrdtool.xport call, which
+        aligns them on the same rows. Returns (timerange, dsnames, values),
+        where values is the (len(cfs), len(dsnames), numrows) float array,
+        with NaN for unknown.
+        '''
+        flush_rrd(self.rrdfile)
+        step = resolution if resolution is not None else STEP
+        args = ['--start', str(starttime), '--end', str(endtime),
+                '--step', str(step),
+                '--maxrows', str((endtime - starttime) // step + 2)]
+        for cf in cfs:
+            for dsname in DSNAMES:
+                vname = "{}_{}".format(dsname, cf.lower())
+                args.append("DEF:{}={}:{}:{}".format(
+                    vname, self.rrdfile, dsname, cf))
+                args.append("XPORT:{}".format(vname))
+        result = rrdtool.xport(*(daemon_args() + args))
+        meta = result['meta']
+        values = np.array(result['data'], dtype=float).reshape(
+            len(result['data']), len(cfs), len(DSNAMES))
+        return ((meta['start'], meta['end'], meta['step']), tuple(DSNAMES),
+                values.transpose(1, 2, 0))
 
 
 class RRDCollect(StoppableThread):
     '''Thread to collect model data and store in RRD.'''
 
-    def __init__(self):
+    def __init__(self, write_behind=False, flush_interval=FLUSH_INTERVAL):
         super(RRDCollect, self).__init__()
-        self.apiclient = APIClient()
+        self.apiclient = session
+        self.backend = get_backend()
+        # In write-behind mode, samples are buffered in a journal which is
+        # periodically flushed to the RRD.
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.journal = None
+        # Protects self.pending and self.processing.
         self.lock = threading.Lock()
+        # Sample times waiting to be collected, in order.
+        self.pending = deque()
+        self.processing = False
+        self.metrics = MetricsRegistry()
+        self.overruns = self.metrics.counter(
+            "feemodel_collect_overruns_total",
+            "Ticks which found the previous update still running.")
+        self.late = self.metrics.counter(
+            "feemodel_collect_late_samples_total",
+            "Samples collected more than STEP late.")
+        self.skipped = self.metrics.counter(
+            "feemodel_collect_skipped_samples_total",
+            "Samples dropped for being more than HEARTBEAT late.")
+        # Seconds from the sample time to the end of its RRD update.
+        self.lag = None
+        self.lag_gauge = self.metrics.gauge(
+            "feemodel_collect_lag_seconds",
+            "Seconds from the last sample time to the end of its update.")
+        write_latency_help = "Latency of the storage and journal writes."
+        self.write_latency = self.metrics.histogram(
+            "feemodel_collect_write_seconds", write_latency_help,
+            target="storage")
+        self.journal_latency = self.metrics.histogram(
+            "feemodel_collect_write_seconds", write_latency_help,
+            target="journal")
+        self.pool = ThreadPool(MAX_API_WORKERS)
+        self.latencies = {}
 
     def init_rrd(self):
         timenow = int(time())
         starttime = timenow - (timenow % STEP)
         self.next_update = starttime + STEP
-        if not os.path.exists(RRDFILE):
+        if not self.backend.exists():
             try:
-                create_rrd(starttime)
+                self.backend.create(starttime)
             except Exception:
                 logger.exception("Unable to create RRD.")
                 self.stop()
+        if self.write_behind:
+            self.journal = RRDJournal(
+                self.backend, flush_interval=self.flush_interval,
+                write_latency=self.write_latency)
+            self.journal.replay()
 
     @StoppableThread.auto_restart(3)
     def run(self):
@@ -86,71 +292,201 @@ class RRDCollect(StoppableThread):
         logger.info(
             "Starting RRD collection, next update at {}".
             format(ctime(self.next_update)))
-        self.sleep_till_next()
-        while not self.is_stopped():
-            self.update_async(self.next_update)
-            self.next_update += STEP
+        if self.journal is not None:
+            self.journal.start()
+        try:
             self.sleep_till_next()
+            while not self.is_stopped():
+                self.update_async(self.next_update)
+                self.next_update += STEP
+                self.sleep_till_next()
+        finally:
+            if self.journal is not None:
+                self.journal.stop()
 
     def update_async(self, currtime):
-        """Call self.update in a new thread."""
-        threading.Thread(target=self._update, args=(currtime,)).start()
+        """Queue the sample for currtime and process the queue.
+
+        The queue is processed in a new thread, unless the previous
+        update is still running (an overrun), in which case that thread
+        picks up the sample when it is done.
+        """
+        with self.lock:
+            self.pending.append(currtime)
+            if self.processing:
+                self.overruns.inc()
+                logger.info(
+                    "Previous update still running at {}, {} samples "
+                    "queued ({} overruns so far).".
+                    format(currtime, len(self.pending), self.overruns.value))
+                return
+            self.processing = True
+        threading.Thread(target=self._process_pending).start()
+
+    def _process_pending(self):
+        """Update the RRD with the queued samples, in order."""
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.processing = False
+                    return
+                currtime = self.pending.popleft()
+            self._update(currtime)
 
     def _update(self, currtime):
-        unlocked = self.lock.acquire(False)
-        if not unlocked:
+        lag = time() - currtime
+        if lag > HEARTBEAT:
+            # The RRD would record the interval as unknown anyway.
+            self.skipped.inc()
+            logger.warning(
+                "Skipped sample at {}, {:.1f}s late is beyond the RRD "
+                "heartbeat ({} skipped so far).".
+                format(currtime, lag, self.skipped.value))
             return
+        if lag > STEP:
+            self.late.inc()
+            logger.info(
+                "Collecting late sample at {}, {:.1f}s late "
+                "({} late so far).".format(currtime, lag, self.late.value))
+        measurements = self.collect_measurements()
+        for dsname, value in zip(DSNAMES, measurements):
+            if value == -1:
+                self.metrics.counter(
+                    "feemodel_collect_datasource_failures_total",
+                    "Samples in which a datasource could not be measured.",
+                    datasource=dsname).inc()
+        # Update the RRD!
+        writestart = time()
+        try:
+            if self.journal is not None:
+                self.journal.append(format_update(currtime, *measurements))
+                write_latency = self.journal_latency
+            else:
+                self.backend.update([(currtime, measurements)])
+                write_latency = self.write_latency
+        except Exception:
+            logger.exception("Error in updating RRD.")
+        else:
+            write_latency.observe(time() - writestart)
+        self.lag = time() - currtime
+        self.lag_gauge.set(self.lag)
+        logger.debug("Collection lag is {:.1f}s.".format(self.lag))
+
+    def get_api_calls(self):
+        """Return the list of (callname, numvalues, fn) API calls.
+
+        Each fn takes no args and returns a list of numvalues datasource
+        values; concatenated in order, they are in DATASOURCES order.
+        """
+        client = self.apiclient
+
+        def feerate(conftime):
+            # Get feerate for specified confirmation / wait time. The
+            # estimates are separate calls, each with its own deadline,
+            # since the API can't batch them (see APISession).
+            return lambda: [client.estimatefee(conftime)['feerate']]
+
+        calls = [("fee{}".format(conftime), 1, feerate(conftime))
+                 for conftime in CONFTIMES]
+        calls.extend([
+            # Get mempool size with fee (i.e. total size of txs with
+            # feerate >= MINRELAYTXFEE)
+            ("mempool", 1, lambda: [client.get_mempool()['sizewithfee']]),
+            # Get tx byterate with fee
+            ("txrate", 1, lambda: [client.get_txrate()['ratewithfee']]),
+            # Get pools capacity
+            ("pools", 1, lambda: [client.get_pools()['caps'][-1]]),
+            # Get the p-distance
+            ("prediction", 1,
+             lambda: [client.get_prediction()['pdistance']]),
+        ])
+        return calls
+
+    def collect_measurements(self):
+        """Make the API calls concurrently and return the measurements.
+
+        Each call has a deadline of API_CALL_TIMEOUT seconds from the time
+        it starts (see wait_call); a call that fails or misses its deadline
+        yields the -1 sentinel for each of its values. Per-call latencies
+        are stored in self.latencies.
+
+        A call which misses its deadline is not waited for, but it still
+        holds its worker until it returns, so the requests themselves are
+        bounded by the API session's REQUEST_TOTAL_TIMEOUT.
+        """
+        calls = self.get_api_calls()
+        issuetime = time()
+        results = []
+        for callname, numvalues, fn in calls:
+            callstart = []
+            results.append((
+                callname, numvalues, callstart,
+                self.pool.apply_async(self._timed_call,
+                                      (callname, fn, callstart))))
         measurements = []
-        # Get feerate for specified confirmation / wait time
-        for conftime in [12, 20, 30, 60]:
+        latencies = {}
+        for callname, numvalues, callstart, result in results:
             try:
-                fee_estimate = self.apiclient.estimatefee(conftime)['feerate']
-            except Exception:
-                logger.exception("Error in getting conftime %d." % conftime)
-                fee_estimate = -1
-            measurements.append(fee_estimate)
+                values, latency = self.wait_call(result, issuetime,
+                                                 callstart)
+            except TimeoutError:
+                logger.error(
+                    "Timeout in getting {} after {}s.".
+                    format(callname, API_CALL_TIMEOUT))
+                values, latency = None, None
+                self.metrics.counter(
+                    "feemodel_collect_api_timeouts_total",
+                    "API calls which missed their deadline.",
+                    call=callname).inc()
+            else:
+                self.metrics.histogram(
+                    "feemodel_collect_api_call_seconds",
+                    "Latency of the API calls.",
+                    call=callname).observe(latency)
+            if values is None:
+                values = [-1]*numvalues
+            measurements.extend(values)
+            latencies[callname] = latency
+        self.latencies = latencies
+        logger.debug("API latencies: {}".format(", ".join(
+            "{} {}".format(
+                callname, "timeout" if latencies[callname] is None
+                else "{:.3f}s".format(latencies[callname]))
+            for callname, _dum0, _dum1 in calls)))
+        return measurements
 
-        # Get mempool size with fee (i.e. total size of txs with
-        # feerate >= MINRELAYTXFEE)
-        try:
-            mempoolstats = self.apiclient.get_mempool()
-            mempoolsize = mempoolstats['sizewithfee']
-        except Exception:
-            logger.exception("Exception in getting mempool stats.")
-            mempoolsize = -1
-        # Get tx byterate with fee
-        try:
-            txstats = self.apiclient.get_txrate()
-            txbyterate = txstats['ratewithfee']
-        except Exception:
-            logger.exception("Exception in getting tx byterate.")
-            txbyterate = -1
-        measurements.extend([mempoolsize, txbyterate])
+    @staticmethod
+    def wait_call(result, issuetime, callstart):
+        """Get the call result, or raise TimeoutError at its deadline.
 
-        # Get pools capacity
-        try:
-            pools_stats = self.apiclient.get_pools()
-            cap = pools_stats['caps'][-1]
-        except Exception:
-            logger.exception("Exception in getting pools stats.")
-            cap = -1
-        measurements.append(cap)
+        The deadline is API_CALL_TIMEOUT seconds after the call started,
+        or after it was issued if it hasn't started, which happens if all
+        the workers are busy.
+        """
+        while True:
+            starttime = callstart[0] if callstart else issuetime
+            remaining = starttime + API_CALL_TIMEOUT - time()
+            if remaining <= 0 and not result.ready():
+                raise TimeoutError
+            result.wait(max(0, remaining))
+            if result.ready():
+                return result.get()
 
-        # Get the p-distance
-        try:
-            predictstats = self.apiclient.get_prediction()
-            pdistance = predictstats['pdistance']
-        except Exception:
-            logger.exception("Exception in getting p-distance.")
-            pdistance = -1
-        measurements.append(pdistance)
+    @staticmethod
+    def _timed_call(callname, fn, callstart):
+        """Call fn and return (values, latency in seconds).
 
-        # Update the RRD!
+        The start time is appended to callstart. values is None if the
+        call raised.
+        """
+        starttime = time()
+        callstart.append(starttime)
         try:
-            update_rrd(currtime, *measurements)
+            values = fn()
         except Exception:
-            logger.exception("Error in updating RRD.")
-        self.lock.release()
+            logger.exception("Exception in getting {}.".format(callname))
+            values = None
+        return values, time() - starttime
 
     def sleep_till_next(self):
         '''Sleep till the next update time.'''
@@ -163,7 +499,14 @@ def cli():
 
 
 @cli.command()
-def collect():
+@click.option("--write-behind", "-w", is_flag=True,
+              help="Buffer samples in a journal and flush them in batches.")
+@click.option("--flush-interval", "-f", type=click.INT,
+              default=FLUSH_INTERVAL,
+              help="Seconds between journal flushes in write-behind mode.")
+@click.option("--metrics-port", "-m", type=click.INT, default=METRICS_PORT,
+              help="Local port for the metrics endpoint, 0 to disable.")
+def collect(write_behind, flush_interval, metrics_port):
     """Start RRD collection."""
     formatter = logging.Formatter(
         '%(asctime)s:%(name)s [%(levelname)s] %(message)s')
@@ -171,30 +514,55 @@ def collect():
         RRDLOGFILE, maxBytes=1000000, backupCount=1)
     filehandler.setLevel(logging.DEBUG)
     filehandler.setFormatter(formatter)
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(filehandler)
-    RRDCollect().run()
+    for _logger in [logger,
+                    logging.getLogger('feemodeldata.rrdjournal'),
+                    logging.getLogger('feemodeldata.storage'),
+                    logging.getLogger('feemodeldata.metrics')]:
+        _logger.setLevel(logging.DEBUG)
+        _logger.addHandler(filehandler)
+    collector = RRDCollect(write_behind=write_behind,
+                           flush_interval=flush_interval)
+    if metrics_port:
+        # The metrics are optional; collect without them if e.g. the port
+        # is taken.
+        try:
+            MetricsServer(collector.metrics, port=metrics_port).start()
+        except Exception:
+            logger.exception("Unable to serve metrics on port {}.".
+                             format(metrics_port))
+    collector.run()
 
 
 @cli.command()
+@click.option("--window", "-w", type=click.INT, default=86400,
+              help="Seconds of source data to read per fetch.")
+@click.option("--batchsize", "-b", type=click.INT, default=500,
+              help="Max number of points per RRD update.")
 @click.argument("source", type=click.STRING, required=True)
 @click.argument("dest", type=click.STRING, required=True)
-def transfer(source, dest):
-    """Extend dest with source."""
-    destlast = rrdtool.last(dest)
-    timerange, datasources, datapoints = rrdtool.fetch(
-        source,
-        'AVERAGE',
-        '--start', str(destlast)
-    )
-    starttime, endtime, interval = timerange
-    correctlen = (timerange[1] - timerange[0]) / STEP
-    assert interval == STEP
-    assert correctlen == int(correctlen)
-    for t, datapoint in zip(range(starttime+STEP, endtime, STEP), datapoints):
-        updatestr = "{}:{}:{}:{}:{}:{}:{}:{}:{}".format(t, *datapoint)
-        if datapoint[1] is None:
-            click.echo("Warning, not supposed to be None!")
-            continue
-        rrdtool.update(dest, updatestr)
-        click.echo("Updated {}".format(updatestr))
+def transfer(source, dest, window, batchsize):
+    """Extend dest with source.
+
+    Resumes from dest's last update if interrupted.
+    """
+    from feemodeldata.rrdtransfer import transfer as _transfer
+
+    def report(numpoints, cursor, elapsed):
+        click.echo("Transferred {} points up to {} ({:.0f} points/s).".format(
+            numpoints, ctime(cursor), numpoints / max(elapsed, 1e-6)))
+
+    numpoints = _transfer(source, dest, window=window, batchsize=batchsize,
+                          callback=report)
+    click.echo("Done, {} points transferred.".format(numpoints))
+
+
+@cli.command()
+@click.argument("primary", type=click.STRING, required=True)
+@click.argument("secondary", type=click.STRING, required=True)
+@click.argument("dest", type=click.STRING, required=True)
+def merge(primary, secondary, dest):
+    """Fill the gaps in primary from secondary, into a new RRD dest."""
+    from feemodeldata.rrdtransfer import merge as _merge
+    for cf, pdp_per_row, numfilled in _merge(primary, secondary, dest):
+        click.echo("{} {}s archive: filled {} values.".format(
+            cf, pdp_per_row*STEP, numfilled))
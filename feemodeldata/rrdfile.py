@@ -0,0 +1,226 @@
+'''Zero-copy reader of RRD files.
+
+The file is memory-mapped, and its header, datasource and RRA
+definitions are parsed in place. Each RRA's ring buffer is a NumPy view of
+the mapped file, so reading data copies nothing until it is used. The live
+header and RRA row pointers are also views, so the reader sees the updates
+which rrdtool makes in place after the file was opened.
+
+The on-disk layout is that of rrdtool's rrd_format.h on 64-bit platforms
+(8 byte unsigned long, time_t and double), file versions 0003 and 0004:
+
+    stat_head (128 bytes)
+    ds_def (120 bytes) * ds_cnt
+    rra_def (120 bytes) * rra_cnt
+    live_head (16 bytes)
+    pdp_prep (112 bytes) * ds_cnt
+    cdp_prep (80 bytes) * rra_cnt * ds_cnt
+    rra_ptr (8 bytes) * rra_cnt
+    data: for each rra, row_cnt * ds_cnt doubles
+'''
+from __future__ import division
+
+import mmap
+
+import numpy as np
+
+# Written into the header to check that the file's floats are readable.
+FLOAT_COOKIE = 8.642135E130
+RRD_VERSIONS = [b'0003', b'0004']
+
+STAT_HEAD = np.dtype([
+    ('cookie', 'S4'),
+    ('version', 'S5'),
+    ('pad', 'V7'),
+    ('float_cookie', 'f8'),
+    ('ds_cnt', 'u8'),
+    ('rra_cnt', 'u8'),
+    ('pdp_step', 'u8'),
+    ('par', 'f8', (10,)),
+])
+DS_DEF = np.dtype([
+    ('ds_nam', 'S20'),
+    ('dst', 'S20'),
+    ('par', 'f8', (10,)),
+])
+RRA_DEF = np.dtype([
+    ('cf_nam', 'S20'),
+    ('pad', 'V4'),
+    ('row_cnt', 'u8'),
+    ('pdp_cnt', 'u8'),
+    ('par', 'f8', (10,)),
+])
+LIVE_HEAD = np.dtype([
+    ('last_up', 'i8'),
+    ('last_up_usec', 'i8'),
+])
+PDP_PREP_SIZE = 112
+CDP_PREP_SIZE = 80
+
+
+class RRDFile(object):
+    '''Memory-mapped RRD file.
+
+    Raises ValueError if the file is not an RRD in a supported format.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self.mmap
+        if len(buf) < STAT_HEAD.itemsize:
+            raise ValueError("{} is not an RRD.".format(filename))
+        head = np.frombuffer(buf, STAT_HEAD, 1)[0]
+        if head['cookie'] != b'RRD':
+            raise ValueError("{} is not an RRD.".format(filename))
+        if head['version'] not in RRD_VERSIONS:
+            raise ValueError("{} has unsupported RRD version {}.".format(
+                filename, head['version']))
+        if head['float_cookie'] != FLOAT_COOKIE:
+            raise ValueError("{} was written on an incompatible "
+                             "platform.".format(filename))
+        ds_cnt = int(head['ds_cnt'])
+        rra_cnt = int(head['rra_cnt'])
+        self.step = int(head['pdp_step'])
+
+        offset = STAT_HEAD.itemsize
+        ds_defs = np.frombuffer(buf, DS_DEF, ds_cnt, offset)
+        offset += ds_defs.nbytes
+        rra_defs = np.frombuffer(buf, RRA_DEF, rra_cnt, offset)
+        offset += rra_defs.nbytes
+        self.live_head = np.frombuffer(buf, LIVE_HEAD, 1, offset)
+        offset += (LIVE_HEAD.itemsize + PDP_PREP_SIZE*ds_cnt +
+                   CDP_PREP_SIZE*rra_cnt*ds_cnt)
+        rra_ptrs = np.frombuffer(buf, 'u8', rra_cnt, offset)
+        offset += rra_ptrs.nbytes
+
+        self.dsnames = tuple(ds_nam.decode('ascii')
+                             for ds_nam in ds_defs['ds_nam'])
+        self.archives = []
+        for idx, rra_def in enumerate(rra_defs):
+            numrows = int(rra_def['row_cnt'])
+            data = np.frombuffer(buf, 'f8', numrows*ds_cnt, offset).reshape(
+                numrows, ds_cnt)
+            offset += data.nbytes
+            self.archives.append(Archive(
+                self, rra_def['cf_nam'].decode('ascii'),
+                int(rra_def['pdp_cnt'])*self.step, data, rra_ptrs[idx:idx+1]))
+        if offset > len(buf):
+            raise ValueError("{} is truncated.".format(filename))
+
+    @property
+    def lastupdate(self):
+        return int(self.live_head[0]['last_up'])
+
+    def fetch(self, cf, starttime, endtime, resolution=None):
+        '''Fetch the data in the time range, like rrdtool.fetch.
+
+        The archive is chosen as rrdtool does. Returns (timerange, dsnames,
+        columns), where columns is a list of one float array per
+        datasource, with NaN for unknown. If the rows are stored
+        contiguously in the archive, the columns are views of the file.
+        '''
+        archive = self.select_archive(cf, starttime, endtime, resolution)
+        interval = archive.interval
+        datastart = starttime - starttime % interval
+        # rrdtool rounds the end up to the next interval even if it is
+        # already aligned.
+        dataend = endtime - endtime % interval + interval
+        values = archive.get_rows(datastart + interval, dataend)
+        return (datastart, dataend, interval), self.dsnames, list(values.T)
+
+    def select_archive(self, cf, starttime, endtime, resolution=None):
+        '''Choose the archive to fetch from, as rrdtool does.
+
+        Of the archives with consolidation function cf which cover the
+        whole range, the one whose interval is closest to resolution is
+        chosen. If none does, the one which covers the most of the range
+        is chosen, with ties broken by the interval.
+        '''
+        if resolution is None:
+            resolution = self.step
+        bestfull = None
+        bestpart = None
+        for archive in self.archives:
+            if archive.cf != cf:
+                continue
+            calend = archive.lastrow
+            calstart = calend - archive.interval*archive.numrows
+            stepdiff = abs(resolution - archive.interval)
+            if calstart <= starttime and calend >= endtime:
+                if bestfull is None or stepdiff < bestfull[0]:
+                    bestfull = (stepdiff, archive)
+            else:
+                match = endtime - starttime
+                if starttime < calstart:
+                    match -= calstart - starttime
+                if endtime > calend:
+                    match -= endtime - calend
+                if (bestpart is None or match > bestpart[0] or
+                        (match == bestpart[0] and stepdiff < bestpart[1])):
+                    bestpart = (match, stepdiff, archive)
+        if bestfull is not None:
+            return bestfull[1]
+        if bestpart is not None:
+            return bestpart[2]
+        raise ValueError("No {} archive.".format(cf))
+
+
+class Archive(object):
+    '''An RRA of an RRDFile.
+
+    data is the (numrows, numds) ring buffer view, and rra_ptr the view of
+    the index of its most recent row.
+    '''
+
+    def __init__(self, rrdfile, cf, interval, data, rra_ptr):
+        self.rrdfile = rrdfile
+        self.cf = cf
+        self.interval = interval
+        self.data = data
+        self.numrows = len(data)
+        self.rra_ptr = rra_ptr
+
+    @property
+    def lastrow(self):
+        '''Time of the most recent row.'''
+        lastupdate = self.rrdfile.lastupdate
+        return lastupdate - lastupdate % self.interval
+
+    def get_segments(self):
+        '''Get the ring buffer in time order, as (older, newer) views.
+
+        The most recent row is the last row of newer. Each row is the
+        consolidated data point at lastrow - (numrows-1-i)*interval, where
+        i is the row's index in time order.
+        '''
+        currow = int(self.rra_ptr[0])
+        return self.data[currow+1:], self.data[:currow+1]
+
+    def get_rows(self, starttime, endtime):
+        '''Get the rows with times in [starttime, endtime].
+
+        The times must be multiples of the interval. Rows which are not
+        stored are NaN. If the rows are stored contiguously, the result is
+        a view of the file.
+        '''
+        numrows = (endtime - starttime) // self.interval + 1
+        if numrows <= 0:
+            return self.data[:0]
+        lastrow = self.lastrow
+        currow = int(self.rra_ptr[0])
+        # Age in rows of the first row, relative to the most recent.
+        firstage = (lastrow - starttime) // self.interval
+        lastage = (lastrow - endtime) // self.interval
+        if lastage >= 0 and firstage < self.numrows:
+            firstidx = (currow - firstage) % self.numrows
+            lastidx = (currow - lastage) % self.numrows
+            if firstidx <= lastidx:
+                return self.data[firstidx:lastidx+1]
+        rows = np.empty((numrows, self.data.shape[1]))
+        rows.fill(np.nan)
+        ages = firstage - np.arange(numrows)
+        stored = (ages >= 0) & (ages < self.numrows)
+        rows[stored] = self.data[(currow - ages[stored]) % self.numrows]
+        return rows
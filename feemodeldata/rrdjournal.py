@@ -0,0 +1,106 @@
+'''Write-behind journal for RRD updates.'''
+
+import os
+import threading
+import logging
+from time import time
+
+from feemodel.util import StoppableThread
+
+from feemodeldata.util import atomic_write
+
+# Seconds between flushes of the journal to the RRD.
+FLUSH_INTERVAL = 600
+
+logger = logging.getLogger(__name__)
+
+
+class RRDJournal(StoppableThread):
+    '''Buffers storage updates in an append-only journal file.
+
+    Each rrdtool update string is appended (and fsynced) to the journal,
+    which is a cheap sequential write. Every flush_interval seconds, the
+    journal entries are written to the storage backend in a single update
+    call and then removed from the journal. Entries which were never
+    flushed, e.g. because of a crash, are written by replay() on startup.
+    '''
+
+    def __init__(self, backend, journalfile=None,
+                 flush_interval=FLUSH_INTERVAL, write_latency=None):
+        super(RRDJournal, self).__init__()
+        self.backend = backend
+        if journalfile is None:
+            journalfile = backend.path + '.journal'
+        self.journalfile = journalfile
+        self.flush_interval = flush_interval
+        # Histogram (see feemodeldata.metrics) of the backend update times.
+        self.write_latency = write_latency
+        self.lock = threading.Lock()
+
+    def run(self):
+        logger.info("Starting RRD journal flusher.")
+        while not self.is_stopped():
+            self.sleep(self.flush_interval)
+            self.flush()
+        logger.info("RRD journal flusher stopped.")
+
+    def append(self, updatestr):
+        '''Append an rrdtool update string to the journal.'''
+        with self.lock:
+            with open(self.journalfile, "a") as f:
+                f.write(updatestr + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def flush(self):
+        '''Write the journal entries to the storage backend.'''
+        with self.lock:
+            updatestrs = self._read_entries()
+        numentries = len(updatestrs)
+        if not numentries:
+            return
+        try:
+            lastupdate = self.backend.last()
+            # Entries up to the last update were already written, e.g. if
+            # we crashed before the journal was truncated.
+            samples = [sample for sample in map(parse_update, updatestrs)
+                       if sample[0] > lastupdate]
+            writestart = time()
+            self.backend.update(samples)
+        except Exception:
+            logger.exception("Error in flushing RRD journal.")
+            return
+        if self.write_latency is not None and samples:
+            self.write_latency.observe(time() - writestart)
+        with self.lock:
+            # Keep anything appended while we were updating.
+            remaining = self._read_entries()[numentries:]
+            self._write_entries(remaining)
+        logger.info("Flushed {} journal entries.".format(numentries))
+
+    def replay(self):
+        '''Write any entries left over from a previous run.'''
+        if os.path.exists(self.journalfile):
+            logger.info("Replaying RRD journal {}.".format(self.journalfile))
+            self.flush()
+
+    def _read_entries(self):
+        try:
+            with open(self.journalfile, "r") as f:
+                lines = f.readlines()
+        except IOError:
+            return []
+        # A line without a newline is an append that was cut short.
+        return [line.rstrip('\n') for line in lines if line.endswith('\n')]
+
+    def _write_entries(self, updatestrs):
+        with atomic_write(self.journalfile, fsync=True) as f:
+            for updatestr in updatestrs:
+                f.write(updatestr + '\n')
+
+
+def parse_update(updatestr):
+    '''Get (updatetime, values) from an rrdtool update string.'''
+    fields = updatestr.split(':')
+    values = [None if field == 'U' else float(field) for field in fields[1:]]
+    return int(fields[0]), values
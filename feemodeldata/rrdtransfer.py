@@ -0,0 +1,156 @@
+'''Bulk transfer of data between RRDs.'''
+
+import os
+import subprocess
+import xml.etree.ElementTree as ET
+from time import time
+
+import numpy as np
+import rrdtool
+
+from feemodeldata.rrdcollect import (STEP, daemon_args, fetch_rrd,
+                                     flush_rrd, format_update)
+
+# Seconds of source data to read per fetch.
+TRANSFER_WINDOW = 86400
+# Max number of points per rrdtool.update call.
+TRANSFER_BATCH = 500
+
+
+def transfer(source, dest, window=TRANSFER_WINDOW, batchsize=TRANSFER_BATCH,
+             callback=None):
+    '''Extend dest with the source AVERAGE data after dest's last update.
+
+    The source is read window seconds at a time, and written to dest in
+    batches of up to batchsize points per rrdtool.update call. Since each
+    batch advances dest's last update time, that is the checkpoint: an
+    interrupted transfer resumes from there when run again. Rows which are
+    entirely unknown are skipped.
+
+    After each window, callback is called with args (numpoints, cursor,
+    elapsed), where numpoints is the total number of points written so
+    far, cursor is the time up to which source has been transferred, and
+    elapsed is the time in seconds since the transfer started.
+
+    Returns the total number of points written.
+    '''
+    flush_rrd(source)
+    flush_rrd(dest)
+    # Fetches older than the 1 min archive would be served at a coarser
+    # resolution.
+    cursor = max(rrdtool.last(dest), rrdtool.first(source) - STEP)
+    sourcelast = rrdtool.last(source)
+    numpoints = 0
+    starttime = time()
+    while cursor < sourcelast:
+        windowend = min(cursor + window, sourcelast)
+        updatestrs = get_updatestrs(source, cursor, windowend)
+        for idx in range(0, len(updatestrs), batchsize):
+            batch = updatestrs[idx:idx+batchsize]
+            rrdtool.update(dest, *(daemon_args() + batch))
+            numpoints += len(batch)
+        cursor = windowend
+        if callback is not None:
+            callback(numpoints, cursor, time() - starttime)
+    return numpoints
+
+
+def get_updatestrs(source, starttime, endtime):
+    '''Get the update strings for source's points in (starttime, endtime].'''
+    timerange, datasources, columns = fetch_rrd(
+        'AVERAGE', starttime, endtime, rrdfile=source, cached=False)
+    datastart, dataend, interval = timerange
+    assert interval == STEP
+    values = np.array(columns).T
+    times = np.arange(datastart+STEP, dataend+STEP, STEP)
+    keep = ((times > starttime) & (times <= endtime) &
+            ~np.isnan(values).all(axis=1))
+    return [format_update(t, *[None if d != d else d for d in datapoint])
+            for t, datapoint in zip(times[keep].tolist(),
+                                    values[keep].tolist())]
+
+
+def merge(primary, secondary, dest):
+    '''Write to dest a copy of primary with its gaps filled from secondary.
+
+    Both RRDs are dumped, and in every archive (all consolidation
+    functions and resolutions), each unknown value in primary is replaced
+    by secondary's value for the same archive, row time and datasource,
+    if that is known. RRDs can't be updated before their last update, so
+    the result is restored to dest, which must not already exist.
+
+    Returns a list of (cf, pdp_per_row, numfilled) for each archive.
+    '''
+    if os.path.exists(dest):
+        raise ValueError("{} already exists.".format(dest))
+    flush_rrd(primary)
+    flush_rrd(secondary)
+    primary_root = dump_rrd(primary)
+    secondary_root = dump_rrd(secondary)
+    if get_dsnames(primary_root) != get_dsnames(secondary_root):
+        raise ValueError("Datasources of {} and {} differ.".
+                         format(primary, secondary))
+
+    secondary_rras = dict(
+        ((cf, pdp_per_row), (times, values))
+        for cf, pdp_per_row, times, values, _dum in get_rras(secondary_root))
+    results = []
+    for cf, pdp_per_row, times, values, rows in get_rras(primary_root):
+        numfilled = 0
+        if (cf, pdp_per_row) in secondary_rras:
+            stimes, svalues = secondary_rras[(cf, pdp_per_row)]
+            # Align secondary's rows to primary's by time.
+            idxs = np.searchsorted(stimes, times)
+            idxs[idxs == len(stimes)] = 0
+            aligned = stimes[idxs] == times
+            fillmask = (np.isnan(values) & aligned[:, np.newaxis] &
+                        ~np.isnan(svalues[idxs]))
+            for rowidx, dsidx in zip(*np.nonzero(fillmask)):
+                rows[rowidx][dsidx].text = "{:.10e}".format(
+                    svalues[idxs[rowidx], dsidx])
+            numfilled = int(fillmask.sum())
+        results.append((cf, pdp_per_row, numfilled))
+
+    xmlfile = dest + '.xml'
+    try:
+        ET.ElementTree(primary_root).write(xmlfile)
+        subprocess.check_call(['rrdtool', 'restore', xmlfile, dest])
+    finally:
+        if os.path.exists(xmlfile):
+            os.remove(xmlfile)
+    return results
+
+
+def dump_rrd(rrdfile):
+    '''Get the root element of the rrdtool XML dump of rrdfile.'''
+    return ET.fromstring(subprocess.check_output(['rrdtool', 'dump', rrdfile]))
+
+
+def get_dsnames(root):
+    '''Get the datasource names from an RRD dump.'''
+    return [ds.find('name').text.strip() for ds in root.findall('ds')]
+
+
+def get_rras(root):
+    '''Get the archives from an RRD dump.
+
+    Returns a list of (cf, pdp_per_row, times, values, rows) for each
+    archive, where times is the array of row end times, values is the
+    (numrows, numds) array of values, with NaN for unknown, and rows is
+    the list of <v> elements of each row. Rows are in time order, the
+    last one being the row for the last update.
+    '''
+    step = int(root.find('step').text)
+    lastupdate = int(root.find('lastupdate').text)
+    rras = []
+    for rra in root.findall('rra'):
+        cf = rra.find('cf').text.strip()
+        pdp_per_row = int(rra.find('pdp_per_row').text)
+        rows = [row.findall('v') for row in rra.find('database')]
+        rrastep = step*pdp_per_row
+        lastrowtime = lastupdate - lastupdate % rrastep
+        times = lastrowtime - rrastep*np.arange(len(rows))[::-1]
+        values = np.array([[float(v.text) for v in row] for row in rows])
+        values = values.reshape(len(rows), -1)
+        rras.append((cf, pdp_per_row, times, values, rows))
+    return rras
@@ -0,0 +1,305 @@
+'''Columnar storage backend for the collected data.
+
+This is an alternative to storing the data in an RRD. Each datasource is
+stored at full resolution in its own memory-mapped array file, which is
+grown as needed instead of wrapping around, so the full resolution history
+is kept indefinitely. The consolidated (AVERAGE/MIN/MAX) archives are
+also arrays, computed incrementally as each consolidation interval is
+completed.
+
+Like the RRD backend, fetch returns (timerange, dsnames, columns), where
+timerange and dsnames are as in rrdtool.fetch, and columns is a list of
+one float array per datasource, with NaN for unknown. Within the stored
+range, the columns are slices of the memory-mapped arrays, so no data is
+copied.
+'''
+from __future__ import division
+
+import os
+import json
+import logging
+
+import numpy as np
+
+from feemodeldata.util import atomic_write
+
+# Number of full resolution rows by which to grow the array files.
+GROW_ROWS = 10080
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnarStore(object):
+    '''Store of datasource arrays in directory.
+
+    datasources and rras are lists of rrdtool DS and RRA definition
+    strings, and step is the sample interval in seconds, as in
+    rrdtool.create. Only the GAUGE datasource type is supported, and the
+    RRA row counts are ignored since nothing is ever discarded. Samples are
+    expected at multiples of step.
+    '''
+
+    def __init__(self, directory, datasources, rras, step):
+        self.directory = directory
+        self.path = directory
+        self.step = step
+        self.metafile = os.path.join(directory, 'meta.json')
+        self.dsnames = []
+        heartbeats, mins, maxs = [], [], []
+        for ds in datasources:
+            _dum, name, dstype, heartbeat, dsmin, dsmax = ds.split(':')
+            if dstype != 'GAUGE':
+                raise ValueError("Unsupported DS type {}.".format(dstype))
+            self.dsnames.append(name)
+            heartbeats.append(int(heartbeat))
+            mins.append(float('-inf') if dsmin == 'U' else float(dsmin))
+            maxs.append(float('inf') if dsmax == 'U' else float(dsmax))
+        self.heartbeats = np.array(heartbeats)
+        self.mins = np.array(mins)
+        self.maxs = np.array(maxs)
+        # (cf, xff, pdp_per_row) of each archive. The full resolution data
+        # is the AVERAGE archive with 1 pdp per row.
+        self.archives = [('AVERAGE', 0., 1)]
+        for rra in rras:
+            _dum, cf, xff, pdp_per_row, _dum = rra.split(':')
+            if (cf, int(pdp_per_row)) != ('AVERAGE', 1):
+                self.archives.append((cf, float(xff), int(pdp_per_row)))
+        self._meta = None
+
+    def exists(self):
+        return os.path.exists(self.metafile)
+
+    def create(self, starttime):
+        '''Create an empty store.
+
+        starttime is aligned down to the longest consolidation interval,
+        so that every archive's rows are aligned to multiples of its
+        interval, as in an RRD.
+        '''
+        if self.exists():
+            raise ValueError("{} already exists.".format(self.directory))
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        maxpdp = max(pdp for _dum0, _dum1, pdp in self.archives)
+        maxinterval = maxpdp*self.step
+        starttime = int(starttime)
+        starttime -= starttime % maxinterval
+        self._write_meta({
+            'step': self.step,
+            'starttime': starttime,
+            'lastupdate': starttime,
+            'dsnames': self.dsnames
+        })
+        for archive in self.archives:
+            for dsname in self.dsnames:
+                open(self._get_filename(dsname, archive), 'wb').close()
+
+    def last(self):
+        '''Get the time of the last update.'''
+        return self.meta['lastupdate']
+
+    def update(self, samples):
+        '''Add samples, a list of (updatetime, values) in time order.
+
+        values has one value per datasource, with None for unknown. As in
+        an RRD, values outside the datasource min/max are unknown, and a
+        sample more than the heartbeat after the previous one leaves the
+        interval in between unknown.
+        '''
+        if not samples:
+            return
+        meta = self.meta
+        starttime = meta['starttime']
+        lastupdate = meta['lastupdate']
+        fullres = self._open_archive(self.archives[0], 'r+')
+        for updatetime, values in samples:
+            updatetime = int(updatetime)
+            if updatetime <= lastupdate:
+                raise ValueError(
+                    "Illegal update time {}, last update is {}.".
+                    format(updatetime, lastupdate))
+            values = np.array(
+                [np.nan if v is None else v for v in values], dtype=float)
+            with np.errstate(invalid='ignore'):
+                values[(values < self.mins) | (values > self.maxs)] = np.nan
+            values[updatetime - lastupdate > self.heartbeats] = np.nan
+            # The sample applies to each step since the previous one.
+            firstidx = (lastupdate - starttime) // self.step
+            endidx = (updatetime - starttime) // self.step
+            fullres = self._reserve(fullres, self.archives[0], endidx)
+            for column, value in zip(fullres, values):
+                column[firstidx:endidx] = value
+            self._consolidate(lastupdate, updatetime)
+            lastupdate = updatetime
+        for column in fullres:
+            column.flush()
+        meta['lastupdate'] = lastupdate
+        self._write_meta(meta)
+        logger.info("Store updated with {} samples up to {}.".
+                    format(len(samples), lastupdate))
+
+    def fetch(self, cf, starttime, endtime, resolution=None):
+        '''Fetch the data in the time range, like rrdtool.fetch.
+
+        Chooses the archive with consolidation function cf whose interval
+        is resolution, or else the finest coarser one, or else the
+        coarsest one.
+        '''
+        archive = self._select_archive(cf, resolution)
+        interval = archive[2]*self.step
+        datastart = starttime - starttime % interval
+        dataend = endtime - endtime % interval
+        if endtime % interval:
+            dataend += interval
+        numrows = (dataend - datastart) // interval
+        firstidx = (datastart - self.meta['starttime']) // interval
+        columns = []
+        for column in self._open_archive(archive, 'r'):
+            if firstidx >= 0 and firstidx + numrows <= len(column):
+                columns.append(column[firstidx:firstidx+numrows])
+                continue
+            padded = np.empty(numrows)
+            padded.fill(np.nan)
+            start = max(firstidx, 0)
+            end = min(firstidx + numrows, len(column))
+            if start < end:
+                padded[start-firstidx:end-firstidx] = column[start:end]
+            columns.append(padded)
+        return (datastart, dataend, interval), tuple(self.dsnames), columns
+
+    def fetch_multi(self, cfs, starttime, endtime, resolution=None):
+        '''Fetch the data of several consolidation functions at once.
+
+        Returns (timerange, dsnames, values), where values is the
+        (len(cfs), len(dsnames), numrows) array. The archives of the cfs
+        must have the same intervals.
+        '''
+        values = []
+        timeranges = set()
+        for cf in cfs:
+            timerange, dsnames, columns = self.fetch(
+                cf, starttime, endtime, resolution)
+            timeranges.add(timerange)
+            values.append(columns)
+        if len(timeranges) > 1:
+            raise ValueError("The {} archives are not aligned.".format(cfs))
+        return timeranges.pop(), tuple(self.dsnames), np.array(values)
+
+    def get_archives(self, cf):
+        '''Get the archives with consolidation function cf.
+
+        Returns a list of (interval, firsttime) sorted by interval. Nothing
+        is discarded, so firsttime is the store's start time.
+        '''
+        return sorted(
+            (pdp*self.step, self.meta['starttime'])
+            for archivecf, _dum, pdp in self.archives if archivecf == cf)
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with open(self.metafile, 'r') as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    def _consolidate(self, prevupdate, updatetime):
+        '''Compute the archive rows completed by the update.'''
+        starttime = self.meta['starttime']
+        fullres = None
+        for archive in self.archives[1:]:
+            cf, xff, pdp = archive
+            interval = pdp*self.step
+            firstrow = (prevupdate - starttime) // interval
+            endrow = (updatetime - starttime) // interval
+            if endrow <= firstrow:
+                continue
+            if fullres is None:
+                fullres = self._open_archive(self.archives[0], 'r')
+            columns = self._reserve(
+                self._open_archive(archive, 'r+'), archive, endrow)
+            for column, fullcolumn in zip(columns, fullres):
+                pdps = fullcolumn[firstrow*pdp:endrow*pdp].reshape(-1, pdp)
+                column[firstrow:endrow] = consolidate(pdps, cf, xff)
+                column.flush()
+
+    def _select_archive(self, cf, resolution):
+        archives = sorted(
+            [archive for archive in self.archives if archive[0] == cf],
+            key=lambda archive: archive[2])
+        if not archives:
+            raise ValueError("No {} archive.".format(cf))
+        if resolution is None:
+            return archives[0]
+        for archive in archives:
+            if archive[2]*self.step >= resolution:
+                return archive
+        return archives[-1]
+
+    def _open_archive(self, archive, mode):
+        '''Get the memory-mapped arrays of archive, one per datasource.'''
+        columns = []
+        for dsname in self.dsnames:
+            filename = self._get_filename(dsname, archive)
+            if not os.path.getsize(filename):
+                columns.append(np.empty(0))
+            else:
+                columns.append(np.memmap(filename, dtype='f8', mode=mode))
+        return columns
+
+    def _reserve(self, columns, archive, numrows):
+        '''Grow the archive's arrays to at least numrows rows.
+
+        New rows are unknown. Returns the (re-opened) arrays.
+        '''
+        if all(len(column) >= numrows for column in columns):
+            return columns
+        growrows = max(GROW_ROWS // archive[2], 1)
+        for dsname, column in zip(self.dsnames, columns):
+            newsize = max(numrows, len(column) + growrows)
+            padding = np.empty(newsize - len(column))
+            padding.fill(np.nan)
+            if isinstance(column, np.memmap):
+                column.flush()
+            with open(self._get_filename(dsname, archive), 'ab') as f:
+                padding.tofile(f)
+        return self._open_archive(archive, 'r+')
+
+    def _get_filename(self, dsname, archive):
+        cf, _dum, pdp = archive
+        if pdp == 1:
+            return os.path.join(self.directory, '{}.f8'.format(dsname))
+        return os.path.join(
+            self.directory, '{}.{}.{}.f8'.format(dsname, cf, pdp))
+
+    def _write_meta(self, meta):
+        with atomic_write(self.metafile) as f:
+            json.dump(meta, f)
+        self._meta = meta
+
+
+def consolidate(pdps, cf, xff):
+    '''Consolidate each row of the 2-D array pdps.
+
+    As in an RRD, a row is unknown if more than the fraction xff of its
+    values are unknown; otherwise the known values are consolidated.
+    '''
+    known = ~np.isnan(pdps)
+    numknown = known.sum(axis=1)
+    valid = numknown >= (1 - xff)*pdps.shape[1]
+    valid &= numknown > 0
+    result = np.empty(pdps.shape[0])
+    result.fill(np.nan)
+    rows = pdps[valid]
+    if cf == 'AVERAGE':
+        result[valid] = np.where(known[valid], rows, 0).sum(axis=1) / \
+            numknown[valid]
+    elif cf == 'MIN':
+        result[valid] = np.where(known[valid], rows, np.inf).min(axis=1)
+    elif cf == 'MAX':
+        result[valid] = np.where(known[valid], rows, -np.inf).max(axis=1)
+    elif cf == 'LAST':
+        lastidx = pdps.shape[1] - 1 - np.argmax(known[valid][:, ::-1], axis=1)
+        result[valid] = rows[np.arange(len(rows)), lastidx]
+    else:
+        raise ValueError("Unsupported CF {}.".format(cf))
+    return result
@@ -1,11 +1,15 @@
-import pytz
+import os
+import threading
 from calendar import timegm
 from time import sleep
 from functools import wraps
+from contextlib import contextmanager
 
 
 def utc_to_timestamp(dt):
     """Convert utc datetime to unix timestamp."""
+    # Imported here so that the rest of util doesn't require pytz.
+    import pytz
     dt_utc = pytz.utc.localize(dt)
     return timegm(dt_utc.utctimetuple())
 
@@ -37,3 +41,31 @@ def retry(wait=1, maxtimes=3, logger=None):
                     sleep(wait)
         return decorated
     return decorator
+
+
+@contextmanager
+def atomic_write(filename, mode='w', perms=0o666, fsync=False):
+    """Open a temp file for writing, which then replaces filename.
+
+    The temp file is renamed to filename when the block exits normally,
+    and removed if it raises, so readers never see a partial file. Its
+    name has the pid and thread, so that concurrent writers of the same
+    file don't collide. It is created with permissions perms (less the
+    umask), and if fsync, synced to disk before the rename.
+    """
+    tmpfile = "{}.{}.{}.tmp".format(
+        filename, os.getpid(), threading.current_thread().ident)
+    fd = os.open(tmpfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, perms)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmpfile, filename)
+    except BaseException:
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
+        raise
@@ -13,8 +13,13 @@ setup(
         'oauth2client==1.5.1',
         'gspread==0.3.0',
         'plotly',
-        'click'
+        'click',
+        'requests',
+        'numpy'
     ],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
     entry_points={
         'console_scripts': [
             'feemodel-rrd = feemodeldata.rrdcollect:cli',
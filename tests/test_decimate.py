@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+
+from feemodeldata.decimate import lttb, minmax
+
+
+class DecimateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.arange(10000)*60
+        self.y = np.sin(np.arange(10000)/500.)
+        # A one-point spike
+        self.y[4321] = 50
+
+    def test_lttb(self):
+        idxs = lttb(self.x, self.y, 500)
+        self.assertEqual(len(idxs), 500)
+        self.assertEqual(idxs[0], 0)
+        self.assertEqual(idxs[-1], 9999)
+        self.assertTrue((np.diff(idxs) > 0).all())
+        self.assertIn(4321, idxs)
+
+    def test_minmax(self):
+        idxs = minmax(self.x, self.y, 500)
+        self.assertTrue(len(idxs) <= 500)
+        self.assertTrue((np.diff(idxs) > 0).all())
+        self.assertIn(4321, idxs)
+        self.assertIn(np.argmin(self.y), idxs)
+
+    def test_gaps(self):
+        self.y[1000:3000] = np.nan
+        for decimate in [lttb, minmax]:
+            idxs = decimate(self.x, self.y, 500)
+            gap = idxs[(idxs >= 1000) & (idxs < 3000)]
+            # The gap is kept, but with no more points than needed.
+            self.assertTrue(len(gap) > 0)
+            self.assertTrue(np.isnan(self.y[gap]).all())
+            outside = idxs[(idxs < 1000) | (idxs >= 3000)]
+            self.assertFalse(np.isnan(self.y[outside]).any())
+
+    def test_short(self):
+        for decimate in [lttb, minmax]:
+            self.assertEqual(list(decimate(self.x[:10], self.y[:10], 20)),
+                             list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from feemodeldata.plotting.plotrrd import (evict_querycache, rrdplot,
+                                           LocalPublisher, REFETCH_POINTS)
+
+NAN = float("nan")
+
+
+class EvictQueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.times = np.arange(60, 660, 60)
+
+    def test_complete(self):
+        tracesdata = np.ones((7, 10))
+        times, data = evict_querycache(self.times, tracesdata, 120)
+        self.assertEqual(list(times), list(self.times[2:-REFETCH_POINTS]))
+        self.assertEqual(data.shape, (7, len(times)))
+
+    def test_unwritten(self):
+        # The last points were fetched before they were written; one trace
+        # being unknown doesn't make a point unwritten.
+        tracesdata = np.ones((7, 10))
+        tracesdata[:, 6:] = NAN
+        tracesdata[3, :] = NAN
+        times, data = evict_querycache(self.times, tracesdata, 0)
+        self.assertEqual(list(times), list(self.times[:6-REFETCH_POINTS]))
+        self.assertTrue(np.isnan(data[3]).all())
+        self.assertFalse(np.isnan(data[:3]).any())
+
+    def test_bands(self):
+        tracesdata = np.ones((3, 7, 10))
+        tracesdata[..., 8:] = NAN
+        # Known in one of the cfs only.
+        tracesdata[2, 0, 7] = NAN
+        tracesdata[:2, :, 7] = NAN
+        times, data = evict_querycache(self.times, tracesdata, 0)
+        self.assertEqual(list(times), list(self.times[:8-REFETCH_POINTS]))
+        self.assertEqual(data.shape, (3, 7, len(times)))
+
+    def test_unknown(self):
+        tracesdata = np.ones((7, 10))*NAN
+        times, data = evict_querycache(self.times, tracesdata, 0)
+        self.assertEqual(len(times), 0)
+        self.assertEqual(data.shape, (7, 0))
+
+    def test_empty(self):
+        times, data = evict_querycache(
+            np.empty(0, dtype=int), np.empty((0, 0)), 0)
+        self.assertEqual(len(times), 0)
+
+
+class IncrementalPlotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.publisher = LocalPublisher(os.path.join(self.tmpdir, 'figs'))
+        self.statedir = os.path.join(self.tmpdir, 'state')
+        self.times = np.arange(60, 1260, 60)
+        self.tracesdata = np.random.RandomState(0).rand(7, 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def plot(self, numpoints, bands=False):
+        times = self.times[:numpoints]
+        tracesdata = self.tracesdata[:, :numpoints]
+        rrdplot(times, tracesdata, filename='test/fig', incremental=True,
+                maxpoints=10, publisher=self.publisher,
+                statedir=self.statedir,
+                bands=np.array([tracesdata, tracesdata]) if bands else None)
+        return self.publisher.read('test/fig')['data']
+
+    def assert_trace(self, trace, traceidx, startidx, endidx):
+        self.assertEqual(trace['y'],
+                         self.tracesdata[traceidx, startidx:endidx].tolist())
+
+    def test_incremental(self):
+        # The trailing points with no known values are held back.
+        self.tracesdata[:, 8:10] = np.nan
+        traces = self.plot(10)
+        self.assertEqual(len(traces), 7)
+        self.assert_trace(traces[0], 0, 0, 8)
+        # Once written, they are sent with the new points by extending.
+        self.tracesdata = np.random.RandomState(1).rand(7, 20)
+        self.tracesdata[:, :8] = [trace['y'] for trace in traces]
+        traces = self.plot(11)
+        for idx, trace in enumerate(traces):
+            self.assert_trace(trace, idx, 0, 11)
+            self.assertEqual(len(trace['x']), 11)
+        # Beyond the slack, the figure is uploaded in full, trimmed to
+        # maxpoints.
+        traces = self.plot(12)
+        self.assert_trace(traces[0], 0, 2, 12)
+        self.assertEqual(len(traces[0]['x']), 10)
+        # No new points, nothing is sent.
+        figfile = self.publisher.get_figfile('test/fig')
+        mtime = os.path.getmtime(figfile)
+        os.utime(figfile, (mtime - 100, mtime - 100))
+        self.plot(12)
+        self.assertEqual(os.path.getmtime(figfile), mtime - 100)
+        # A layout change uploads in full.
+        traces = self.plot(13, bands=True)
+        self.assertEqual(len(traces), 21)
+        self.assert_trace(traces[2], 0, 3, 13)
+        self.assert_trace(traces[0], 0, 3, 13)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import shutil
+import tempfile
+import unittest
+
+import feemodeldata.plotting.pushtables as pushtables
+from feemodeldata.plotting.pushtables import (pushtable, get_blocks,
+                                              get_changed_ranges,
+                                              MAX_DIFF_RANGES)
+
+
+class FakeCell(object):
+
+    def __init__(self, row, col, value):
+        self.row = row
+        self.col = col
+        self.value = value
+
+
+class FakeSpreadsheet(object):
+    id = 'spreadsheet'
+
+
+class FakeWorksheet(object):
+    '''Stand-in for a gspread worksheet, with a header row.'''
+
+    id = 'worksheet'
+    title = 'test'
+    spreadsheet = FakeSpreadsheet()
+
+    def __init__(self, numcols):
+        self.numcols = numcols
+        self.row_count = 1
+        self.values = {}
+        # The sheet rows of each update_cells call.
+        self.updates = []
+
+    def resize(self, rows):
+        self.row_count = rows
+
+    def get_addr_int(self, row, col):
+        return "{}{}".format(chr(ord('A') + col - 1), row)
+
+    def range(self, rangestr):
+        start, end = rangestr.split(':')
+        endcol = ord(end[0]) - ord('A') + 1
+        return [FakeCell(row, col, self.values.get((row, col)))
+                for row in range(int(start[1:]), int(end[1:]) + 1)
+                for col in range(1, endcol + 1)]
+
+    def update_cells(self, cells):
+        for cell in cells:
+            self.values[(cell.row, cell.col)] = cell.value
+        self.updates.append(sorted(set(cell.row for cell in cells)))
+
+    def get_table(self):
+        return [[self.values.get((row, col))
+                 for col in range(1, self.numcols + 1)]
+                for row in range(2, self.row_count + 1)]
+
+
+def get_table_cols(numrows, changed=()):
+    return [list(range(numrows)),
+            [float(i) + (0.5 if i in changed else 0) for i in range(numrows)]]
+
+
+def get_rows(table_cols):
+    return [list(row) for row in zip(*table_cols)]
+
+
+class PushTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.snapshotdir = pushtables.TABLESNAPSHOTDIR
+        pushtables.TABLESNAPSHOTDIR = self.tmpdir
+        self.worksheet = FakeWorksheet(2)
+
+    def tearDown(self):
+        pushtables.TABLESNAPSHOTDIR = self.snapshotdir
+        shutil.rmtree(self.tmpdir)
+
+    def test_full(self):
+        table_cols = get_table_cols(30)
+        pushtable(self.worksheet, table_cols, blockrows=20)
+        self.assertEqual(self.worksheet.row_count, 31)
+        self.assertEqual(self.worksheet.get_table(), get_rows(table_cols))
+        self.assertEqual([len(rows) for rows in self.worksheet.updates],
+                         [20, 10])
+
+    def test_diff(self):
+        pushtable(self.worksheet, get_table_cols(30))
+        self.worksheet.updates = []
+        table_cols = get_table_cols(30, changed=[3, 4, 20])
+        pushtable(self.worksheet, table_cols)
+        self.assertEqual(self.worksheet.updates, [[5, 6, 22]])
+        self.assertEqual(self.worksheet.get_table(), get_rows(table_cols))
+        # Unchanged, so nothing is sent.
+        self.worksheet.updates = []
+        pushtable(self.worksheet, table_cols)
+        self.assertEqual(self.worksheet.updates, [])
+
+    def test_stale_snapshot(self):
+        pushtable(self.worksheet, get_table_cols(30))
+        self.worksheet.updates = []
+        maxage = pushtables.TABLESNAPSHOT_MAXAGE
+        pushtables.TABLESNAPSHOT_MAXAGE = -1
+        try:
+            pushtable(self.worksheet, get_table_cols(30, changed=[3]))
+        finally:
+            pushtables.TABLESNAPSHOT_MAXAGE = maxage
+        self.assertEqual(self.worksheet.updates, [list(range(2, 32))])
+
+    def test_no_diff(self):
+        pushtable(self.worksheet, get_table_cols(30))
+        self.worksheet.updates = []
+        pushtable(self.worksheet, get_table_cols(30, changed=[3]),
+                  diff=False)
+        self.assertEqual(self.worksheet.updates, [list(range(2, 32))])
+
+    def test_resize(self):
+        pushtable(self.worksheet, get_table_cols(30))
+        self.worksheet.updates = []
+        table_cols = get_table_cols(35)
+        pushtable(self.worksheet, table_cols)
+        # Only the new rows are sent.
+        self.assertEqual(self.worksheet.updates, [list(range(32, 37))])
+        self.assertEqual(self.worksheet.row_count, 36)
+        self.assertEqual(self.worksheet.get_table(), get_rows(table_cols))
+
+    def test_resume(self):
+        table_cols = get_table_cols(6)
+        # Fail all the tries of the second block.
+        update_cells = self.worksheet.update_cells
+
+        def failing_update_cells(cells):
+            if cells[0].row == 4:
+                raise IOError("Update failed.")
+            update_cells(cells)
+
+        self.worksheet.update_cells = failing_update_cells
+        with self.assertRaises(IOError):
+            pushtable(self.worksheet, table_cols, blockrows=2)
+        self.assertEqual(self.worksheet.updates, [[2, 3]])
+        self.worksheet.update_cells = update_cells
+        pushtable(self.worksheet, table_cols, blockrows=2)
+        self.assertEqual(self.worksheet.updates, [[2, 3], [4, 5], [6, 7]])
+        self.assertEqual(self.worksheet.get_table(), get_rows(table_cols))
+        # The snapshot was written once the push completed.
+        self.worksheet.updates = []
+        pushtable(self.worksheet, table_cols, blockrows=2)
+        self.assertEqual(self.worksheet.updates, [])
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_changed_ranges(self):
+        oldrows = get_rows(get_table_cols(30))
+        rows = get_rows(get_table_cols(32, changed=[0, 5, 6, 7, 12]))
+        self.assertEqual(get_changed_ranges(oldrows, iter(rows)),
+                         [(0, 1), (5, 8), (12, 13), (30, 32)])
+
+    def test_max_diff_ranges(self):
+        numrows = 4*MAX_DIFF_RANGES
+        oldrows = get_rows(get_table_cols(numrows))
+        changed = list(range(1, numrows - 2, 2))
+        rows = get_rows(get_table_cols(numrows, changed=changed))
+        self.assertEqual(get_changed_ranges(oldrows, rows),
+                         [(1, changed[-1] + 1)])
+
+    def test_blocks(self):
+        self.assertEqual(get_blocks([(0, 3), (5, 6), (8, 13)], 2),
+                         [[[0, 2]], [[2, 3], [5, 6]], [[8, 10]],
+                          [[10, 12]], [[12, 13]]])
+        self.assertEqual(get_blocks([], 2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from feemodeldata.rrdfile import RRDFile
+
+try:
+    import rrdtool
+    from feemodeldata.rrdcollect import DATASOURCES, RRA, STEP
+except ImportError:
+    rrdtool = None
+
+
+@unittest.skipIf(rrdtool is None, "rrdtool is not available.")
+class RRDFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rrdfile = os.path.join(self.tmpdir, 'test.rrd')
+        self.starttime = 86400*100
+        rrdtool.create(self.rrdfile, '--start', str(self.starttime),
+                       '--step', str(STEP), DATASOURCES, RRA)
+        # 12 days, so that the 1 min archive has wrapped around, with a
+        # gap in the middle.
+        rng = np.random.RandomState(0)
+        updatestrs = []
+        for i in range(1, 12*1440):
+            if 5000 <= i < 5100:
+                continue
+            values = rng.rand(len(DATASOURCES))
+            updatestrs.append("{}:{}".format(
+                self.starttime + i*STEP, ':'.join(map(repr, values))))
+        for idx in range(0, len(updatestrs), 1000):
+            rrdtool.update(self.rrdfile, *updatestrs[idx:idx+1000])
+        self.lastupdate = rrdtool.last(self.rrdfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_header(self):
+        rrd = RRDFile(self.rrdfile)
+        self.assertEqual(rrd.step, STEP)
+        self.assertEqual(rrd.lastupdate, self.lastupdate)
+        self.assertEqual(list(rrd.dsnames),
+                         [ds.split(':')[1] for ds in DATASOURCES])
+        self.assertEqual(
+            [(archive.cf, archive.interval // STEP, archive.numrows)
+             for archive in rrd.archives],
+            [(rra.split(':')[1], int(rra.split(':')[3]),
+              int(rra.split(':')[4])) for rra in RRA])
+
+    def test_fetch(self):
+        rrd = RRDFile(self.rrdfile)
+        queries = [
+            ('AVERAGE', self.lastupdate - 3*3600, self.lastupdate, None),
+            ('AVERAGE', self.lastupdate - 7*86400, self.lastupdate, 60),
+            ('AVERAGE', self.starttime, self.lastupdate + 3600, 10800),
+            ('MIN', self.starttime, self.lastupdate, 10800),
+            ('MAX', self.starttime - 86400, self.lastupdate, 86400),
+            ('AVERAGE', self.lastupdate - 3600 - 17, self.lastupdate + 13,
+             None),
+        ]
+        for cf, starttime, endtime, resolution in queries:
+            args = ['--start', str(starttime), '--end', str(endtime)]
+            if resolution is not None:
+                args.extend(['--resolution', str(resolution)])
+            timerange, dsnames, datapoints = rrdtool.fetch(
+                self.rrdfile, cf, *args)
+            expected = np.array(datapoints, dtype=float)
+            rtimerange, rdsnames, columns = rrd.fetch(
+                cf, starttime, endtime, resolution)
+            self.assertEqual(tuple(rtimerange), tuple(timerange))
+            self.assertEqual(tuple(rdsnames), tuple(dsnames))
+            np.testing.assert_array_equal(np.array(columns).T, expected)
+        # An aligned end is still rounded up, to an unknown trailing row.
+        timerange, dsnames, columns = rrd.fetch(
+            'AVERAGE', self.lastupdate - 3600, self.lastupdate)
+        self.assertEqual(timerange[1], self.lastupdate + STEP)
+        self.assertTrue(np.isnan(np.array(columns)[:, -1]).all())
+
+    def test_segments(self):
+        rrd = RRDFile(self.rrdfile)
+        archive = rrd.archives[0]
+        older, newer = archive.get_segments()
+        self.assertEqual(len(older) + len(newer), archive.numrows)
+        # Views of the file, not copies.
+        self.assertFalse(older.flags.owndata)
+        self.assertFalse(newer.flags.owndata)
+        timerange, dsnames, datapoints = rrdtool.fetch(
+            self.rrdfile, 'AVERAGE', '--start',
+            str(archive.lastrow - archive.numrows*archive.interval),
+            '--end', str(archive.lastrow), '--resolution', str(STEP))
+        # The last row is the one after lastrow, which the end is rounded
+        # up to.
+        np.testing.assert_array_equal(
+            np.concatenate([older, newer]),
+            np.array(datapoints[:-1], dtype=float))
+
+
+if __name__ == '__main__':
+    unittest.main()
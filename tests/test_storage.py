@@ -0,0 +1,87 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from feemodeldata.storage import ColumnarStore
+
+DATASOURCES = [
+    "DS:a:GAUGE:180:0:U",
+    "DS:b:GAUGE:180:0:1",
+]
+RRA = [
+    "RRA:AVERAGE:0.5:1:10080",
+    "RRA:AVERAGE:0.5:180:8760",
+    "RRA:MIN:0.5:180:8760",
+    "RRA:MAX:0.5:1440:10950",
+]
+STEP = 60
+
+
+class ColumnarStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = ColumnarStore(self.tmpdir + '/store', DATASOURCES, RRA,
+                                   STEP)
+        self.store.create(86400*100 + 500)
+        self.starttime = self.store.last()
+        self.assertEqual(self.starttime, 86400*100)
+
+    def test_fullres(self):
+        samples = [(self.starttime + STEP*(i+1), [i, 0.5 if i % 2 else 2])
+                   for i in range(20000)]
+        # Grows the arrays across several updates.
+        self.store.update(samples[:100])
+        self.store.update(samples[100:])
+        store = ColumnarStore(self.tmpdir + '/store', DATASOURCES, RRA, STEP)
+        self.assertEqual(store.last(), samples[-1][0])
+        timerange, dsnames, columns = store.fetch(
+            'AVERAGE', self.starttime, self.starttime + 600, STEP)
+        self.assertEqual(timerange,
+                         (self.starttime, self.starttime + 600, STEP))
+        self.assertEqual(dsnames, ('a', 'b'))
+        self.assertTrue(np.array_equal(columns[0], np.arange(10)))
+        # Values above the DS max are unknown.
+        self.assertTrue(np.isnan(columns[1][::2]).all())
+        self.assertTrue((columns[1][1::2] == 0.5).all())
+
+    def test_consolidation(self):
+        samples = [(self.starttime + STEP*(i+1), [i, 0.5 if i % 2 else 2])
+                   for i in range(2000)]
+        self.store.update(samples)
+        timerange, dsnames, columns = self.store.fetch(
+            'AVERAGE', self.starttime, self.starttime + 3*10800, 10800)
+        self.assertEqual(timerange[2], 10800)
+        self.assertEqual(list(columns[0]), [89.5, 269.5, 449.5])
+        # Half the pdps are known, which meets the xff.
+        self.assertEqual(list(columns[1]), [0.5]*3)
+        timerange, dsnames, columns = self.store.fetch(
+            'MIN', self.starttime, self.starttime + 3*10800, 10800)
+        self.assertEqual(list(columns[0]), [0, 180, 360])
+        timerange, dsnames, columns = self.store.fetch(
+            'MAX', self.starttime - 86400, self.starttime + 2*86400, 86400)
+        self.assertTrue(np.isnan(columns[0][0]))
+        self.assertEqual(columns[0][1], 1439)
+        # Incomplete interval
+        self.assertTrue(np.isnan(columns[0][2]))
+
+    def test_heartbeat(self):
+        self.store.update([(self.starttime + STEP, [1, None])])
+        self.store.update([(self.starttime + 5*STEP, [2, 0.5])])
+        self.store.update([(self.starttime + 7*STEP, [3, 0.5])])
+        timerange, dsnames, columns = self.store.fetch(
+            'AVERAGE', self.starttime, self.starttime + 7*STEP, STEP)
+        self.assertEqual(columns[0][0], 1)
+        self.assertTrue(np.isnan(columns[0][1:5]).all())
+        self.assertEqual(list(columns[0][5:]), [3, 3])
+        self.assertRaises(ValueError, self.store.update,
+                          [(self.starttime + 7*STEP, [3, 0.5])])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()